@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+autotune_inference.py
+- Ajuste automático de la inferencia en CPU del EfficientNetB3 de 6 clases en la máquina local.
+- Barre con entradas sintéticas:
+    * hilos intra-op / inter-op de TensorFlow (cada combinación en un subproceso, porque
+      TensorFlow solo acepta fijarlos antes de inicializarse)
+    * tamaño de batch
+    * motor: predict (model.predict), call (model(x)), function (tf.function) y tflite
+      (intérprete TFLite con XNNPACK)
+  y mide throughput (imágenes/s) y latencia p95 por batch.
+- Escribe un perfil por host en models/inference_profiles/<host>.json con dos secciones:
+    * serving -> mejor throughput con batch <= SERVING_MAX_BATCH y p95 <= --max_p95_ms (app.py)
+    * batch   -> mejor throughput sin restricción de latencia (distributed_scoring.py)
+  app.py y el scorer lo cargan al arrancar con load_profile() + apply_threads().
+- El .tflite que sirve la app solo se exporta desde el modelo real y guarda al lado el hash
+  del .keras de origen: si el modelo cambia, make_predict_fn vuelve al motor 'function'.
+  Sin modelo real se mide con la arquitectura sin pesos exportada a un .tflite temporal.
+- Ejecutar:
+    python autotune_inference.py --threads 1,2,4,8 --batch_sizes 1,4,8,16,32 --max_p95_ms 800
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+import subprocess
+import itertools
+import argparse
+import tempfile
+import hashlib
+import socket
+import json
+import time
+import os
+
+# ---------------- CONFIG ----------------
+ROOT = Path(__file__).resolve().parent  # -> src/
+MODEL_PATH = ROOT.parent / "models" / "final_effnetB3_classifier_6classes.keras"
+TFLITE_PATH = ROOT.parent / "models" / "final_effnetB3_classifier_6classes.tflite"
+TFLITE_META_PATH = TFLITE_PATH.with_suffix(".tflite.json")   # hash del .keras de origen
+PROFILES_DIR = ROOT.parent / "models" / "inference_profiles"
+
+INPUT_SHAPE = (300, 300, 3)
+NUM_CLASSES = 6
+ENGINES = ["predict", "call", "function", "tflite"]
+SERVING_MAX_BATCH = 16
+DEFAULT_BATCH_SIZE = 5
+# ----------------------------------------
+
+def profile_path(host: str = None):
+    return PROFILES_DIR / f"{host or socket.gethostname()}.json"
+
+def load_profile(role: str, path: Path = None):
+    """Sección 'serving' o 'batch' del perfil de este host, o None si no existe."""
+    path = Path(path) if path else profile_path()
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        return json.load(f).get(role)
+
+def apply_threads(profile):
+    """Fija los hilos de TensorFlow del perfil. Debe llamarse antes de cargar el modelo."""
+    if not profile:
+        return
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(profile["intra_threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(profile["inter_threads"])
+    except RuntimeError as e:
+        # TensorFlow ya estaba inicializado: se mantienen los valores actuales
+        print(f"No se pudieron aplicar los hilos del perfil: {e}")
+
+def file_sha1(path: Path, chunk_size: int = 1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def tflite_is_current():
+    """True si el .tflite existe y se exportó desde la versión actual del .keras."""
+    if not (TFLITE_PATH.exists() and TFLITE_META_PATH.exists() and MODEL_PATH.exists()):
+        return False
+    with open(TFLITE_META_PATH, "r") as f:
+        meta = json.load(f)
+    return meta.get("source_sha1") == file_sha1(MODEL_PATH)
+
+def make_predict_fn(model, engine: str = "predict", batch_size: int = DEFAULT_BATCH_SIZE,
+                    num_threads: int = None, tflite_path: Path = None):
+    """
+    Devuelve fn(batch float32 (N, 300, 300, 3)) -> probs (N, num_classes) numpy con el motor
+    indicado. El batch se procesa en trozos de batch_size.
+    tflite_path: solo para medir; por defecto se usa TFLITE_PATH si corresponde al .keras actual.
+    """
+    import tensorflow as tf
+
+    if engine == "tflite":
+        if tflite_path is None and not tflite_is_current():
+            print(f"{TFLITE_PATH} no existe o no corresponde a {MODEL_PATH.name}; se usa el motor 'function'")
+            engine = "function"
+        else:
+            interpreter = tf.lite.Interpreter(model_path=str(tflite_path or TFLITE_PATH), num_threads=num_threads)
+            inp = interpreter.get_input_details()[0]["index"]
+            out = interpreter.get_output_details()[0]["index"]
+            state = {"batch": None}
+
+            def run(chunk):
+                if state["batch"] != len(chunk):
+                    interpreter.resize_tensor_input(inp, chunk.shape)
+                    interpreter.allocate_tensors()
+                    state["batch"] = len(chunk)
+                interpreter.set_tensor(inp, chunk)
+                interpreter.invoke()
+                return interpreter.get_tensor(out)
+
+    if engine == "predict":
+        return lambda batch: model.predict(np.asarray(batch, dtype=np.float32), batch_size=batch_size, verbose=0)
+    if engine == "call":
+        run = lambda chunk: model(chunk, training=False).numpy()
+    elif engine == "function":
+        fn = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+        run = lambda chunk: fn(tf.constant(chunk)).numpy()
+
+    def predict(batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        return np.concatenate([run(batch[i:i + batch_size]) for i in range(0, len(batch), batch_size)])
+    return predict
+
+def load_or_build_model():
+    """Modelo real si existe; si no, la misma arquitectura sin pesos (mismo coste de cómputo)."""
+    import tensorflow as tf
+    if MODEL_PATH.exists():
+        return tf.keras.models.load_model(MODEL_PATH)
+    print(f"No existe {MODEL_PATH}; se mide con EfficientNetB3 sin pesos")
+    return tf.keras.applications.EfficientNetB3(weights=None, input_shape=INPUT_SHAPE, classes=NUM_CLASSES)
+
+def export_tflite(model, out_path: Path, source_sha1: str = None):
+    """
+    Convierte el modelo a TFLite (float32). Con source_sha1 (modelo real) se escribe al lado
+    el hash del .keras de origen, que comprueba make_predict_fn antes de servirlo.
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "wb") as f:
+        f.write(converter.convert())
+    if source_sha1 is not None:
+        with open(out_path.with_suffix(".tflite.json"), "w") as f:
+            json.dump({"source": MODEL_PATH.name, "source_sha1": source_sha1}, f, indent=2)
+    print(f"Modelo TFLite guardado en: {out_path}")
+
+def prepare_tflite(scratch_dir: Path):
+    """
+    .tflite a medir: el de servicio (reexportado si el .keras cambió) o, sin modelo real,
+    uno temporal con la arquitectura sin pesos que nunca se sirve.
+    """
+    if not MODEL_PATH.exists():
+        path = scratch_dir / "bench_effnetB3.tflite"
+        export_tflite(load_or_build_model(), path)
+        return path
+    if not tflite_is_current():
+        export_tflite(load_or_build_model(), TFLITE_PATH, file_sha1(MODEL_PATH))
+    return TFLITE_PATH
+
+def bench(intra: int, inter: int, batch_sizes, engines, iters: int, warmup: int, tflite_path: Path = None):
+    """Ejecutado en un subproceso: mide todas las combinaciones para unos hilos fijos."""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra)
+    tf.config.threading.set_inter_op_parallelism_threads(inter)
+
+    model = load_or_build_model()
+    rng = np.random.default_rng(0)
+    for engine in engines:
+        for bs in batch_sizes:
+            try:
+                fn = make_predict_fn(model, engine, bs, num_threads=intra, tflite_path=tflite_path)
+                x = rng.uniform(0, 255, size=(bs, *INPUT_SHAPE)).astype(np.float32)
+                for _ in range(warmup):
+                    fn(x)
+                latencies = []
+                for _ in range(iters):
+                    t0 = time.perf_counter()
+                    fn(x)
+                    latencies.append(time.perf_counter() - t0)
+                latencies = np.asarray(latencies)
+                result = {
+                    "intra_threads": intra,
+                    "inter_threads": inter,
+                    "engine": engine,
+                    "batch_size": bs,
+                    "throughput": float(bs * iters / latencies.sum()),
+                    "p50_ms": float(1000 * np.percentile(latencies, 50)),
+                    "p95_ms": float(1000 * np.percentile(latencies, 95)),
+                }
+            except Exception as e:
+                result = {"intra_threads": intra, "inter_threads": inter, "engine": engine,
+                          "batch_size": bs, "error": str(e)}
+            # Una línea JSON por resultado: la lee el proceso padre
+            print("RESULT " + json.dumps(result), flush=True)
+
+def choose(results, max_batch: int = None, max_p95_ms: float = None):
+    """Configuración con mayor throughput que cumple las restricciones."""
+    candidates = [r for r in results if "error" not in r
+                  and (max_batch is None or r["batch_size"] <= max_batch)
+                  and (max_p95_ms is None or r["p95_ms"] <= max_p95_ms)]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda r: r["throughput"])
+    return {k: best[k] for k in ("intra_threads", "inter_threads", "engine", "batch_size", "throughput", "p95_ms")}
+
+def sweep(threads, inter_threads, batch_sizes, engines, iters: int, warmup: int, max_p95_ms: float):
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        tflite_path = prepare_tflite(Path(scratch_dir)) if "tflite" in engines else None
+        results = run_benchmarks(threads, inter_threads, batch_sizes, engines, iters, warmup, tflite_path)
+    return write_profile(results, max_p95_ms)
+
+def run_benchmarks(threads, inter_threads, batch_sizes, engines, iters: int, warmup: int, tflite_path: Path = None):
+    """Un subproceso por combinación de hilos; devuelve la lista de resultados."""
+    results = []
+    for intra, inter in itertools.product(threads, inter_threads):
+        print(f"Midiendo intra={intra} inter={inter} ...")
+        cmd = [
+            sys.executable, str(Path(__file__).resolve()), "_bench",
+            "--intra", str(intra), "--inter", str(inter),
+            "--batch_sizes", ",".join(map(str, batch_sizes)),
+            "--engines", ",".join(engines),
+            "--iters", str(iters), "--warmup", str(warmup),
+        ]
+        if tflite_path is not None:
+            cmd += ["--tflite_path", str(tflite_path)]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            # Crash del subproceso (OOM, fallo al importar TensorFlow...): se muestra el final de stderr
+            print(f"  ❌ El subproceso terminó con código {proc.returncode}")
+            for line in proc.stderr.strip().splitlines()[-10:]:
+                print(f"     {line}")
+        for line in proc.stdout.splitlines():
+            if not line.startswith("RESULT "):
+                continue
+            r = json.loads(line[len("RESULT "):])
+            results.append(r)
+            if "error" in r:
+                print(f"  {r['engine']:<9} bs={r['batch_size']:<3} error: {r['error']}")
+            else:
+                print(f"  {r['engine']:<9} bs={r['batch_size']:<3} {r['throughput']:7.2f} img/s  p95 {r['p95_ms']:8.1f} ms")
+    return results
+
+def write_profile(results, max_p95_ms: float):
+    """Guarda el perfil del host; no sobrescribe el anterior si no hay mediciones válidas."""
+    if not any("error" not in r for r in results):
+        # Sin mediciones válidas no se sobrescribe un perfil anterior
+        print(f"\n❌ Ninguna configuración se pudo medir: no se guarda el perfil {profile_path()}")
+        return None
+
+    profile = {
+        "host": socket.gethostname(),
+        "cpu_count": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "model": str(MODEL_PATH.name),
+        # None: medido con la arquitectura sin pesos (no había modelo real)
+        "model_sha1": file_sha1(MODEL_PATH) if MODEL_PATH.exists() else None,
+        "serving": choose(results, SERVING_MAX_BATCH, max_p95_ms),
+        "batch": choose(results),
+        "results": results,
+    }
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    path = profile_path()
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+
+    print(f"\nServing: {profile['serving']}")
+    print(f"Batch:   {profile['batch']}")
+    print(f"Perfil guardado en: {path}")
+    return profile
+
+def int_list(text: str):
+    return [int(v) for v in text.split(",") if v]
+
+if __name__ == "__main__":
+    cpus = os.cpu_count() or 1
+    default_threads = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    if len(sys.argv) > 1 and sys.argv[1] == "_bench":
+        # Modo interno: un subproceso por combinación de hilos
+        p = argparse.ArgumentParser()
+        p.add_argument("_bench")
+        p.add_argument("--intra", type=int, required=True)
+        p.add_argument("--inter", type=int, required=True)
+        p.add_argument("--batch_sizes", type=int_list, required=True)
+        p.add_argument("--engines", required=True)
+        p.add_argument("--iters", type=int, required=True)
+        p.add_argument("--warmup", type=int, required=True)
+        p.add_argument("--tflite_path", type=Path, default=None)
+        a = p.parse_args()
+        os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+        bench(a.intra, a.inter, a.batch_sizes, a.engines.split(","), a.iters, a.warmup, a.tflite_path)
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Ajusta hilos, batch y motor de inferencia en CPU para este host.")
+    parser.add_argument("--threads", type=int_list, default=default_threads,
+                        help=f"Hilos intra-op a probar, separados por comas (default: {','.join(map(str, default_threads))})")
+    parser.add_argument("--inter_threads", type=int_list, default=[1, 2], help="Hilos inter-op a probar (default: 1,2)")
+    parser.add_argument("--batch_sizes", type=int_list, default=[1, 5, 8, 16, 32], help="Tamaños de batch (default: 1,5,8,16,32)")
+    parser.add_argument("--engines", default=",".join(ENGINES), help=f"Motores (default: {','.join(ENGINES)})")
+    parser.add_argument("--iters", type=int, default=20, help="Repeticiones medidas por combinación (default: 20)")
+    parser.add_argument("--warmup", type=int, default=3, help="Repeticiones de calentamiento (default: 3)")
+    parser.add_argument("--max_p95_ms", type=float, default=1000.0, help="Latencia p95 máxima para serving (default: 1000)")
+    args = parser.parse_args()
+
+    time_start = time.perf_counter()
+    profile = sweep(args.threads, args.inter_threads, args.batch_sizes, args.engines.split(","),
+                    args.iters, args.warmup, args.max_p95_ms)
+    if profile is None:
+        sys.exit(1)
+    print(f"\n✅ Ajuste completado en {(time.perf_counter() - time_start) / 60:.2f} minutos")
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+cascade_classifier.py
+- Clasificación en cascada de dos etapas:
+    * Etapa 1 (criba): modelo ligero MobileNetV3Small a 160x160 entrenado con las mismas
+      etiquetas que notebooks/class_indices.json.
+    * Etapa 2: EfficientNetB3 a 300x300. Solo recibe los elementos dudosos o posiblemente
+      no seguros.
+  Un elemento se resuelve en la etapa 1 solo si el modelo ligero predice "safe" con
+  probabilidad >= safe_threshold y con un margen >= min_margin sobre la segunda clase.
+- Los umbrales se calibran sobre el split "val" del inventario y se guardan en
+  models/cascade_thresholds.json junto con la fracción escalada y el delta de accuracy.
+- Ejecutar:
+    python cascade_classifier.py train --csv data/inventory.csv --epochs 10
+    python cascade_classifier.py calibrate --csv data/inventory.csv --max_accuracy_drop 0.005
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+import argparse
+import json
+import time
+import os
+
+from inventory_store import read_inventory
+from preprocessing import load_batch, read_image
+
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+from tensorflow.keras.applications.efficientnet import preprocess_input as eff_preprocess
+
+# ---------------- CONFIG ----------------
+ROOT = Path(__file__).resolve().parent  # -> src/
+MODELS_DIR = ROOT.parent / "models"
+FULL_MODEL_PATH = MODELS_DIR / "final_effnetB3_classifier_6classes.keras"
+SCREEN_MODEL_PATH = MODELS_DIR / "screen_mobilenetv3_6classes.keras"
+THRESHOLDS_PATH = MODELS_DIR / "cascade_thresholds.json"
+CLASS_INDICES_PATH = ROOT.parent / "notebooks" / "class_indices.json"
+
+FULL_SIZE = (300, 300)
+SCREEN_SIZE = (160, 160)
+SAFE_CLASS = "safe"
+
+DEFAULT_THRESHOLDS = {"safe_threshold": 0.90, "min_margin": 0.50}
+
+# Rejilla de búsqueda para la calibración
+SAFE_THRESHOLD_GRID = [0.50, 0.60, 0.70, 0.80, 0.85, 0.90, 0.93, 0.95, 0.97, 0.98, 0.99]
+MIN_MARGIN_GRID = [0.0, 0.2, 0.4, 0.6, 0.8]
+# ----------------------------------------
+
+def load_class_indices(path: Path = CLASS_INDICES_PATH):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_thresholds(path: Path = THRESHOLDS_PATH):
+    """Devuelve los umbrales calibrados (o los de por defecto si no hay calibración)."""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    if Path(path).exists():
+        with open(path, "r") as f:
+            thresholds.update(json.load(f))
+    return thresholds
+
+def build_screen_model(num_classes: int, input_size=SCREEN_SIZE):
+    """
+    MobileNetV3Small con cabeza de num_classes. Incluye su propio reescalado,
+    por lo que recibe píxeles RGB en [0, 255] igual que EfficientNetB3.
+    """
+    base = tf.keras.applications.MobileNetV3Small(
+        input_shape=(*input_size, 3),
+        include_top=False,
+        weights="imagenet",
+        pooling="avg",
+        include_preprocessing=True,
+    )
+    base.trainable = False
+    x = tf.keras.layers.Dropout(0.2)(base.output)
+    outputs = tf.keras.layers.Dense(num_classes, activation="softmax")(x)
+    model = tf.keras.Model(base.input, outputs, name="screen_mobilenetv3")
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-3),
+                  loss="sparse_categorical_crossentropy",
+                  metrics=["accuracy"])
+    return model
+
+def screen_accepts(screen_probs, safe_idx: int, safe_threshold: float, min_margin: float):
+    """
+    Máscara booleana de los elementos que se resuelven en la etapa 1:
+    predicción "safe" con probabilidad y margen suficientes.
+    """
+    top2 = np.sort(screen_probs, axis=1)[:, -2:]
+    margin = top2[:, 1] - top2[:, 0]
+    return ((np.argmax(screen_probs, axis=1) == safe_idx)
+            & (screen_probs[:, safe_idx] >= safe_threshold)
+            & (margin >= min_margin))
+
+def cascade_predict(batch, full_model, screen_model, safe_idx: int, thresholds: dict, batch_size: int = 8,
+                    full_predict=None):
+    """
+    batch: array (N, 300, 300, 3) con píxeles RGB en [0, 255].
+    full_predict: función opcional batch preprocesado -> probs para la etapa 2 (p. ej. el
+    motor/hilos/batch del perfil de inferencia); por defecto full_model.predict.
+    Devuelve (probs, escalated):
+      probs     -> (N, num_classes), del modelo ligero si se acepta o de B3 si se escala
+      escalated -> máscara booleana de los elementos enviados a EfficientNetB3
+    """
+    batch = np.asarray(batch, dtype=np.float32)
+    small = tf.image.resize(batch, SCREEN_SIZE).numpy()
+    screen_probs = screen_model.predict(small, batch_size=batch_size, verbose=0)
+
+    accepted = screen_accepts(screen_probs, safe_idx,
+                              thresholds["safe_threshold"], thresholds["min_margin"])
+    escalated = ~accepted
+
+    probs = np.array(screen_probs, copy=True)
+    if escalated.any():
+        inputs = eff_preprocess(batch[escalated])
+        if full_predict is not None:
+            probs[escalated] = full_predict(inputs)
+        else:
+            probs[escalated] = full_model.predict(inputs, batch_size=batch_size, verbose=0)
+    return probs, escalated
+
+def read_split(csv_path: Path, split: str):
+    """Filas del inventario de un split con frame/imagen válido. Rutas absolutas en 'path'."""
+    df = read_inventory(csv_path, columns=["category", "relative_path"], valid_only=True, split=split)
+    df = df.assign(path=[str(ROOT.parent / p) for p in df["relative_path"]])
+    return df.reset_index(drop=True)
+
+def train_screen(csv_path: Path, epochs: int, batch_size: int):
+    """Entrena el modelo ligero con los splits train/val del inventario."""
+    class_indices = load_class_indices()
+
+    def make_ds(df, shuffle):
+        labels = [class_indices[c] for c in df["category"]]
+        ds = tf.data.Dataset.from_tensor_slices((df["path"].tolist(), labels))
+        if shuffle:
+            ds = ds.shuffle(len(df), seed=42)
+
+        def decode(path, label):
+            # Misma ruta que en la app: decodificar a 300x300 y reducir a SCREEN_SIZE
+            img = tf.image.resize(tf.cast(read_image(path), tf.float32), SCREEN_SIZE)
+            return img, label
+
+        ds = ds.map(decode, num_parallel_calls=tf.data.AUTOTUNE)
+        # Imágenes ilegibles o demasiado grandes se saltan en vez de abortar el fit
+        ds = ds.apply(tf.data.experimental.ignore_errors())
+        return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    train_df = read_split(csv_path, "train")
+    val_df = read_split(csv_path, "val")
+    print(f"Entrenando modelo ligero: {len(train_df)} train, {len(val_df)} val")
+
+    model = build_screen_model(len(class_indices))
+    model.fit(make_ds(train_df, True), validation_data=make_ds(val_df, False), epochs=epochs)
+
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    model.save(SCREEN_MODEL_PATH)
+    print(f"Modelo ligero guardado en: {SCREEN_MODEL_PATH}")
+
+def calibrate(csv_path: Path, max_accuracy_drop: float, batch_size: int, chunk_size: int = 256):
+    """
+    Calcula las probabilidades de ambos modelos sobre el split val y busca los umbrales
+    que minimizan la fracción escalada con una pérdida de accuracy <= max_accuracy_drop
+    respecto a usar solo EfficientNetB3.
+    """
+    class_indices = load_class_indices()
+    safe_idx = class_indices[SAFE_CLASS]
+    full_model = load_model(FULL_MODEL_PATH)
+    screen_model = load_model(SCREEN_MODEL_PATH)
+
+    val_df = read_split(csv_path, "val")
+    print(f"Calibrando con {len(val_df)} elementos del split val")
+
+    full_probs, screen_probs, labels = [], [], []
+    screen_time = full_time = 0.0
+    for start in range(0, len(val_df), chunk_size):
+        chunk = val_df.iloc[start:start + chunk_size]
+        batch, valid = load_batch(chunk["path"].tolist(), FULL_SIZE)
+        if not valid:
+            continue
+        labels.extend(class_indices[c] for c in chunk["category"].iloc[valid])
+
+        t0 = time.perf_counter()
+        small = tf.image.resize(batch, SCREEN_SIZE).numpy()
+        screen_probs.append(screen_model.predict(small, batch_size=batch_size, verbose=0))
+        t1 = time.perf_counter()
+        full_probs.append(full_model.predict(eff_preprocess(batch), batch_size=batch_size, verbose=0))
+        t2 = time.perf_counter()
+        screen_time += t1 - t0
+        full_time += t2 - t1
+
+    if not labels:
+        print("No hay elementos válidos en el split val")
+        return None
+
+    full_probs = np.concatenate(full_probs)
+    screen_probs = np.concatenate(screen_probs)
+    labels = np.asarray(labels)
+    full_pred = np.argmax(full_probs, axis=1)
+    screen_pred = np.argmax(screen_probs, axis=1)
+    acc_full = float(np.mean(full_pred == labels))
+
+    best = None
+    for safe_threshold in SAFE_THRESHOLD_GRID:
+        for min_margin in MIN_MARGIN_GRID:
+            accepted = screen_accepts(screen_probs, safe_idx, safe_threshold, min_margin)
+            cascade_pred = np.where(accepted, screen_pred, full_pred)
+            acc_cascade = float(np.mean(cascade_pred == labels))
+            escalated = float(1.0 - np.mean(accepted))
+            if acc_full - acc_cascade > max_accuracy_drop:
+                continue
+            if best is None or escalated < best["escalated_fraction"]:
+                best = {
+                    "safe_threshold": safe_threshold,
+                    "min_margin": min_margin,
+                    "escalated_fraction": escalated,
+                    "accuracy_full": acc_full,
+                    "accuracy_cascade": acc_cascade,
+                    "accuracy_delta": acc_cascade - acc_full,
+                }
+
+    if best is None:
+        # Ninguna combinación cumple: se escala todo (equivale a usar solo B3)
+        best = {"safe_threshold": 1.01, "min_margin": 1.0, "escalated_fraction": 1.0,
+                "accuracy_full": acc_full, "accuracy_cascade": acc_full, "accuracy_delta": 0.0}
+
+    n = len(labels)
+    screen_ms = 1000 * screen_time / n
+    full_ms = 1000 * full_time / n
+    best.update({
+        "n_val": n,
+        "max_accuracy_drop": max_accuracy_drop,
+        "screen_ms_per_item": screen_ms,
+        "full_ms_per_item": full_ms,
+        # Coste medio estimado por elemento en cascada respecto a usar solo B3
+        "estimated_speedup": full_ms / (screen_ms + best["escalated_fraction"] * full_ms),
+    })
+
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(THRESHOLDS_PATH, "w") as f:
+        json.dump(best, f, indent=2)
+
+    print(f"Umbrales: safe_threshold={best['safe_threshold']}  min_margin={best['min_margin']}")
+    print(f"Fracción escalada: {best['escalated_fraction']*100:.2f}%")
+    print(f"Accuracy B3: {acc_full:.4f}  cascada: {best['accuracy_cascade']:.4f}  "
+          f"(delta {best['accuracy_delta']:+.4f})")
+    print(f"Aceleración estimada: x{best['estimated_speedup']:.2f}")
+    print(f"Umbrales guardados en: {THRESHOLDS_PATH}")
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clasificador en cascada: modelo ligero + EfficientNetB3.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_train = sub.add_parser("train", help="Entrena el modelo ligero de criba")
+    p_train.add_argument("--csv", default="data/inventory.csv", help="Inventario (default: data/inventory.csv)")
+    p_train.add_argument("--epochs", type=int, default=10, help="Épocas (default: 10)")
+    p_train.add_argument("--batch_size", type=int, default=32, help="Tamaño de batch (default: 32)")
+
+    p_cal = sub.add_parser("calibrate", help="Calibra los umbrales sobre el split val")
+    p_cal.add_argument("--csv", default="data/inventory.csv", help="Inventario (default: data/inventory.csv)")
+    p_cal.add_argument("--max_accuracy_drop", type=float, default=0.005,
+                       help="Pérdida máxima de accuracy permitida frente a B3 (default: 0.005)")
+    p_cal.add_argument("--batch_size", type=int, default=16, help="Tamaño de batch (default: 16)")
+    args = parser.parse_args()
+
+    csv_path = ROOT.parent / args.csv
+    if args.command == "train":
+        train_screen(csv_path, args.epochs, args.batch_size)
+    else:
+        calibrate(csv_path, args.max_accuracy_drop, args.batch_size)
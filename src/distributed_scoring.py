@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+distributed_scoring.py
+- Re-scoring del inventario completo repartido entre varias máquinas que comparten un
+  sistema de ficheros (NFS, SMB...). No hay coordinador: todo se hace con ficheros.
+- Estructura de <workdir>:
+    units.json                -> plan: unidades de trabajo (rangos de id del inventario)
+    leases/unit_00012.lease   -> lease de la unidad (creado con O_CREAT | O_EXCL, atómico)
+    shards/unit_00012.csv     -> salida de la unidad (tmp + os.replace, atómico)
+  Una unidad está terminada si existe su shard.
+- Leases: el worker que crea el fichero es el dueño y renueva su mtime cada `heartbeat`
+  segundos. Un lease sin renovar durante más de `lease_ttl` segundos se considera caducado
+  y otro worker lo reclama (rename atómico a un tombstone + nuevo O_EXCL).
+  Aunque dos workers acaben puntuando la misma unidad, el shard es idéntico y se escribe
+  de forma atómica, así que el resultado es correcto.
+- merge combina los shards en orden de unidad en un único CSV.
+- Ejecutar:
+    python distributed_scoring.py plan  --csv data/inventory.csv --workdir scoring/run1
+    python distributed_scoring.py work  --workdir scoring/run1            (en cada nodo)
+    python distributed_scoring.py merge --workdir scoring/run1 --output scoring/run1/scores.csv
+    python distributed_scoring.py local --csv data/inventory.csv --workdir scoring/test --workers 4 --scorer dummy
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import multiprocessing
+import numpy as np
+import threading
+import argparse
+import socket
+import shutil
+import random
+import uuid
+import json
+import time
+import zlib
+import csv
+import os
+
+from inventory_store import read_inventory
+
+# ---------------- CONFIG ----------------
+ROOT = Path(__file__).resolve().parent  # -> src/
+MODEL_PATH = ROOT.parent / "models" / "final_effnetB3_classifier_6classes.keras"
+CLASS_INDICES_PATH = ROOT.parent / "notebooks" / "class_indices.json"
+
+UNIT_SIZE = 2000        # filas del inventario por unidad de trabajo
+LEASE_TTL = 120.0       # segundos sin heartbeat para considerar un lease caducado
+HEARTBEAT = 15.0        # segundos entre renovaciones del lease
+POLL_INTERVAL = 5.0     # espera cuando todas las unidades pendientes tienen dueño
+DEFAULT_BATCH_SIZE = 32 # batch sin perfil de inferencia ni --batch_size
+# ----------------------------------------
+
+def unit_name(unit: int):
+    return f"unit_{unit:05d}"
+
+def tmp_path_for(path: Path):
+    """
+    Temporal único junto a path. El pid solo no basta: workers de nodos distintos (o
+    contenedores) pueden tener el mismo pid y escribir la misma unidad tras reclamar un lease.
+    """
+    return path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+
+def write_atomic(path: Path, text: str):
+    tmp = tmp_path_for(path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# ---------------- PLAN ----------------
+def plan(csv_path: Path, workdir: Path, unit_size: int = UNIT_SIZE):
+    """Divide las filas válidas del inventario en unidades. Idempotente: reutiliza el plan."""
+    plan_path = workdir / "units.json"
+    if plan_path.exists():
+        with open(plan_path, "r") as f:
+            return json.load(f)
+
+    ids = read_inventory(csv_path, columns=["relative_path"], valid_only=True).index.to_numpy()
+    units = []
+    for k, start in enumerate(range(0, len(ids), unit_size)):
+        chunk = ids[start:start + unit_size]
+        units.append({"unit": k, "id_start": int(chunk[0]), "id_stop": int(chunk[-1]) + 1, "rows": len(chunk)})
+
+    for sub in ("leases", "shards"):
+        (workdir / sub).mkdir(parents=True, exist_ok=True)
+    payload = {"csv": str(csv_path), "unit_size": unit_size, "rows": int(len(ids)), "units": units}
+    write_atomic(plan_path, json.dumps(payload, indent=2))
+    print(f"Plan: {len(ids)} filas en {len(units)} unidades -> {plan_path}")
+    return payload
+
+# ---------------- LEASES ----------------
+class Lease:
+    """Lease sobre una unidad con heartbeat en un hilo aparte."""
+
+    def __init__(self, path: Path, worker_id: str, heartbeat: float = HEARTBEAT):
+        self.path = path
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, args=(heartbeat,), daemon=True)
+        self._thread.start()
+
+    def _beat(self, heartbeat: float):
+        while not self._stop.wait(heartbeat):
+            if not self.owned():
+                self.lost = True
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+
+    def owned(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get("worker") == self.worker_id
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        if self.owned():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+def try_create_lease(path: Path, worker_id: str):
+    """Crea el lease de forma atómica. False si ya existe."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        json.dump({"worker": worker_id, "host": socket.gethostname(), "pid": os.getpid(),
+                   "claimed_at": time.time()}, f)
+    return True
+
+def reclaim_if_expired(path: Path, worker_id: str, lease_ttl: float):
+    """
+    Si el lease ha caducado lo aparta con un rename atómico (solo un worker lo consigue).
+    Si entre la comprobación y el rename otro worker lo renovó o lo volvió a crear,
+    se restaura con os.link (que falla si ya existe otro).
+    """
+    try:
+        if time.time() - os.stat(path).st_mtime <= lease_ttl:
+            return False
+    except FileNotFoundError:
+        return True
+    tomb = path.with_name(f"{path.name}.stale.{worker_id}.{os.getpid()}")
+    try:
+        os.rename(path, tomb)
+    except FileNotFoundError:
+        return True
+    try:
+        if time.time() - os.stat(tomb).st_mtime <= lease_ttl:
+            try:
+                os.link(tomb, path)
+            except FileExistsError:
+                pass
+            return False
+        print(f"  [{worker_id}] Lease caducado reclamado: {path.name}")
+        return True
+    finally:
+        os.remove(tomb)
+
+def claim(workdir: Path, unit: int, worker_id: str, lease_ttl: float, heartbeat: float):
+    path = workdir / "leases" / f"{unit_name(unit)}.lease"
+    if try_create_lease(path, worker_id):
+        return Lease(path, worker_id, heartbeat)
+    if reclaim_if_expired(path, worker_id, lease_ttl) and try_create_lease(path, worker_id):
+        return Lease(path, worker_id, heartbeat)
+    return None
+
+# ---------------- SCORERS ----------------
+def model_scorer(batch_size: int):
+    """
+    Puntúa con EfficientNetB3. Devuelve una función rutas -> (probs, índices válidos).
+    Usa los hilos y el motor del perfil 'batch' del host (autotune_inference.py) si existe.
+    """
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.applications.efficientnet import preprocess_input as eff_preprocess
+    from preprocessing import load_batch
+    import autotune_inference
+
+    profile = autotune_inference.load_profile("batch") or {}
+    autotune_inference.apply_threads(profile)
+    model = load_model(MODEL_PATH)
+    predict = autotune_inference.make_predict_fn(model, profile.get("engine", "predict"), batch_size,
+                                                 num_threads=profile.get("intra_threads"))
+
+    def score(paths):
+        batch, valid = load_batch(paths)
+        if not valid:
+            return np.zeros((0, model.output_shape[-1]), dtype=np.float32), valid
+        return predict(eff_preprocess(batch)), valid
+    return score
+
+def dummy_scorer(num_classes: int, delay: float = 0.002):
+    """
+    Puntuación determinista a partir del hash de la ruta, sin TensorFlow.
+    Sirve para probar la coordinación con varios procesos locales.
+    """
+    def score(paths):
+        time.sleep(delay * len(paths))
+        probs = np.stack([np.random.default_rng(zlib.crc32(p.encode())).dirichlet(np.ones(num_classes))
+                          for p in paths]) if paths else np.zeros((0, num_classes))
+        return probs, list(range(len(paths)))
+    return score
+
+# ---------------- WORKER ----------------
+def score_unit(csv_path: Path, unit: dict, score, inv_class_indices: dict, batch_size: int):
+    """Filas del shard de una unidad."""
+    df = read_inventory(csv_path, columns=["category", "relative_path"], valid_only=True,
+                        id_range=(unit["id_start"], unit["id_stop"]))
+    rows = []
+    for start in range(0, len(df), batch_size):
+        chunk = df.iloc[start:start + batch_size]
+        probs, valid = score([str(ROOT.parent / p) for p in chunk["relative_path"]])
+        for p, i in zip(probs, valid):
+            idx = int(np.argmax(p))
+            row = {
+                "row_id": int(chunk.index[i]),
+                "relative_path": chunk["relative_path"].iloc[i],
+                "category": chunk["category"].iloc[i],
+                "pred_label": inv_class_indices[idx],
+                "confidence": round(float(p[idx]), 6),
+            }
+            row.update({f"p_{inv_class_indices[c]}": round(float(p[c]), 6) for c in range(len(p))})
+            rows.append(row)
+    return rows
+
+def write_shard(path: Path, rows, fieldnames):
+    tmp = tmp_path_for(path)
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+def work(workdir: Path, worker_id: str = None, scorer: str = "model", batch_size: int = None,
+         lease_ttl: float = LEASE_TTL, heartbeat: float = HEARTBEAT, poll_interval: float = POLL_INTERVAL):
+    """Reclama y puntúa unidades hasta que todas tienen shard."""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    with open(workdir / "units.json", "r") as f:
+        plan_data = json.load(f)
+    csv_path = Path(plan_data["csv"])
+    units = plan_data["units"]
+
+    with open(CLASS_INDICES_PATH, "r") as f:
+        class_indices = json.load(f)
+    inv_class_indices = {v: k for k, v in class_indices.items()}
+    fieldnames = (["row_id", "relative_path", "category", "pred_label", "confidence"]
+                  + [f"p_{inv_class_indices[c]}" for c in range(len(inv_class_indices))])
+
+    if batch_size is None:
+        from autotune_inference import load_profile
+        batch_size = (load_profile("batch") or {}).get("batch_size", DEFAULT_BATCH_SIZE)
+    score = model_scorer(batch_size) if scorer == "model" else dummy_scorer(len(class_indices))
+
+    # Cada worker recorre las unidades empezando en un punto distinto para reducir colisiones
+    order = list(range(len(units)))
+    offset = random.Random(worker_id).randrange(len(units)) if units else 0
+    order = order[offset:] + order[:offset]
+
+    done_units = 0
+    time_start = time.perf_counter()
+    while True:
+        pending = [u for u in order if not (workdir / "shards" / f"{unit_name(u)}.csv").exists()]
+        if not pending:
+            break
+        claimed_any = False
+        for u in pending:
+            shard = workdir / "shards" / f"{unit_name(u)}.csv"
+            if shard.exists():
+                continue
+            lease = claim(workdir, u, worker_id, lease_ttl, heartbeat)
+            if lease is None:
+                continue
+            claimed_any = True
+            try:
+                rows = score_unit(csv_path, units[u], score, inv_class_indices, batch_size)
+                if lease.lost:
+                    print(f"  [{worker_id}] Lease perdido en {unit_name(u)}; otro worker la completará")
+                    continue
+                write_shard(shard, rows, fieldnames)
+                done_units += 1
+                print(f"  [{worker_id}] {unit_name(u)}: {len(rows)} filas")
+            finally:
+                lease.release()
+        if not claimed_any:
+            # Las pendientes tienen dueño: esperar a que terminen o caduquen
+            time.sleep(poll_interval)
+
+    elapsed = time.perf_counter() - time_start
+    print(f"[{worker_id}] Terminado: {done_units} unidades en {elapsed:.1f} s")
+    return done_units
+
+# ---------------- MERGE ----------------
+def merge(workdir: Path, output: Path):
+    """Concatena los shards en orden de unidad. Falla si falta alguno."""
+    with open(workdir / "units.json", "r") as f:
+        units = json.load(f)["units"]
+    shards = [workdir / "shards" / f"{unit_name(u['unit'])}.csv" for u in units]
+    missing = [s.name for s in shards if not s.exists()]
+    if missing:
+        print(f"Faltan {len(missing)} shards: {missing[:10]}")
+        return False
+
+    rows = 0
+    tmp = output.with_name(f".{output.name}.tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as out:
+        for k, shard in enumerate(shards):
+            with open(shard, "r", encoding="utf-8") as f:
+                header = f.readline()
+                if k == 0:
+                    out.write(header)
+                for line in f:
+                    out.write(line)
+                    rows += 1
+    os.replace(tmp, output)
+    print(f"Resultado combinado: {output} ({rows} filas de {len(shards)} shards)")
+    return True
+
+def run_local(csv_path: Path, workdir: Path, workers: int, scorer: str, batch_size: int,
+              unit_size: int, lease_ttl: float, heartbeat: float):
+    """Plan + N procesos locales haciendo de nodos + merge."""
+    plan(csv_path, workdir, unit_size)
+    procs = []
+    for i in range(workers):
+        p = multiprocessing.Process(
+            target=work,
+            kwargs=dict(workdir=workdir, worker_id=f"{socket.gethostname()}-local{i}", scorer=scorer,
+                        batch_size=batch_size, lease_ttl=lease_ttl, heartbeat=heartbeat,
+                        poll_interval=0.5),
+        )
+        p.start()
+        procs.append(p)
+    for p in procs:
+        p.join()
+    return merge(workdir, workdir / "scores.csv")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scoring distribuido del inventario con leases en fichero.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p):
+        p.add_argument("--workdir", required=True, help="Directorio compartido del trabajo")
+
+    def add_worker_args(p):
+        p.add_argument("--scorer", default="model", choices=["model", "dummy"], help="Modelo real o puntuación sintética")
+        p.add_argument("--batch_size", type=int, default=None,
+                       help="Tamaño de batch (default: el del perfil del host o 32)")
+        p.add_argument("--lease_ttl", type=float, default=LEASE_TTL, help="Caducidad del lease en segundos (default: 120)")
+        p.add_argument("--heartbeat", type=float, default=HEARTBEAT, help="Intervalo de heartbeat en segundos (default: 15)")
+
+    p_plan = sub.add_parser("plan", help="Crea las unidades de trabajo")
+    add_common(p_plan)
+    p_plan.add_argument("--csv", default="data/inventory.csv", help="Inventario (default: data/inventory.csv)")
+    p_plan.add_argument("--unit_size", type=int, default=UNIT_SIZE, help="Filas por unidad (default: 2000)")
+
+    p_work = sub.add_parser("work", help="Ejecuta un worker en este nodo")
+    add_common(p_work)
+    add_worker_args(p_work)
+    p_work.add_argument("--worker_id", default=None, help="Identificador del worker (default: host-pid)")
+
+    p_merge = sub.add_parser("merge", help="Combina los shards")
+    add_common(p_merge)
+    p_merge.add_argument("--output", required=True, help="CSV combinado de salida")
+
+    p_local = sub.add_parser("local", help="Plan + N workers locales + merge")
+    add_common(p_local)
+    add_worker_args(p_local)
+    p_local.add_argument("--csv", default="data/inventory.csv", help="Inventario (default: data/inventory.csv)")
+    p_local.add_argument("--unit_size", type=int, default=UNIT_SIZE, help="Filas por unidad (default: 2000)")
+    p_local.add_argument("--workers", type=int, default=2, help="Procesos locales (default: 2)")
+    p_local.add_argument("--clean", action="store_true", help="Borra el workdir antes de empezar")
+    args = parser.parse_args()
+
+    workdir = ROOT.parent / args.workdir
+    time_start = time.perf_counter()
+
+    if args.command == "plan":
+        workdir.mkdir(parents=True, exist_ok=True)
+        plan(ROOT.parent / args.csv, workdir, args.unit_size)
+    elif args.command == "work":
+        work(workdir, args.worker_id, args.scorer, args.batch_size, args.lease_ttl, args.heartbeat)
+    elif args.command == "merge":
+        ok = merge(workdir, ROOT.parent / args.output)
+        sys.exit(0 if ok else 1)
+    else:
+        if args.clean and workdir.exists():
+            shutil.rmtree(workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+        ok = run_local(ROOT.parent / args.csv, workdir, args.workers, args.scorer, args.batch_size,
+                       args.unit_size, args.lease_ttl, args.heartbeat)
+        print(f"\n✅ {args.workers} workers en {time.perf_counter() - time_start:.1f} s")
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+embedding_index.py
+- Índice de embeddings para buscar elementos del inventario parecidos a un upload.
+- build: extrae el embedding de la penúltima capa de EfficientNetB3 (entrada de la capa
+  Dense final) para cada fila válida de inventory.csv, lo normaliza (L2) y lo escribe por
+  batches en una matriz float16 memory-mapped:
+    models/embedding_index/embeddings.f16   -> (N, D) float16
+    models/embedding_index/row_ids.npy      -> fila de inventory.csv de cada embedding
+    models/embedding_index/meta.json        -> N, D, tipo de índice, inventario de origen
+                                               (fichero, mtime y número de filas)
+  Con N >= IVF_MIN_ROWS además se entrena un k-means esférico y las filas se reordenan por
+  partición (índice IVF):
+    models/embedding_index/centroids.npy    -> (nlist, D) float32
+    models/embedding_index/list_offsets.npy -> inicio de cada partición (nlist + 1)
+- Los row_id son posiciones en el inventario: si se regenera, el índice queda desfasado
+  (EmbeddingIndex.is_stale()) y hay que reconstruirlo.
+- search: top-k por similitud coseno. Fuerza bruta vectorizada por bloques para índices
+  pequeños; con IVF solo se recorren las nprobe particiones más cercanas.
+- Ejecutar:
+    python embedding_index.py build --csv data/inventory.csv
+    python embedding_index.py search --image upload.jpg --k 10
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+import argparse
+import shutil
+import json
+import time
+import os
+
+from inventory_store import read_inventory, db_path_for
+from preprocessing import load_batch
+
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+
+# ---------------- CONFIG ----------------
+ROOT = Path(__file__).resolve().parent  # -> src/
+MODEL_PATH = ROOT.parent / "models" / "final_effnetB3_classifier_6classes.keras"
+INDEX_DIR = ROOT.parent / "models" / "embedding_index"
+
+IVF_MIN_ROWS = 20000      # a partir de aquí se construye índice IVF
+KMEANS_SAMPLE = 50000     # filas usadas para entrenar los centroides
+KMEANS_ITERS = 10
+DEFAULT_NPROBE = 8
+SEARCH_CHUNK = 65536      # filas por bloque en la búsqueda por fuerza bruta
+SEED = 42
+# ----------------------------------------
+
+def l2_normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+def inventory_signature(csv_path):
+    """Fichero de inventario usado (.sqlite si existe), su mtime y su número de filas."""
+    csv_path = Path(csv_path)
+    db_path = db_path_for(csv_path)
+    source = db_path if db_path.exists() else csv_path
+    return {
+        "inventory_file": str(source),
+        "inventory_mtime": source.stat().st_mtime,
+        "inventory_rows": len(read_inventory(csv_path, columns=["split"])),
+    }
+
+def make_embedder(model):
+    """Submodelo que devuelve la entrada de la última capa (penúltima representación)."""
+    import tensorflow as tf
+    return tf.keras.Model(model.inputs, model.layers[-1].input)
+
+def embed_batch(embedder, batch, batch_size: int = 16):
+    """batch: (N, 300, 300, 3) RGB en [0, 255] -> embeddings (N, D) normalizados."""
+    from tensorflow.keras.applications.efficientnet import preprocess_input as eff_preprocess
+    feats = embedder.predict(eff_preprocess(np.asarray(batch, dtype=np.float32)),
+                             batch_size=batch_size, verbose=0)
+    return l2_normalize(feats)
+
+def train_centroids(sample, nlist: int, iters: int = KMEANS_ITERS, seed: int = SEED):
+    """k-means esférico (similitud coseno) sobre embeddings ya normalizados."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        # particiones vacías conservan su centroide anterior
+        sums[counts == 0] = centroids[counts == 0]
+        centroids = l2_normalize(sums)
+    return centroids
+
+def assign_lists(emb, centroids, chunk: int = SEARCH_CHUNK):
+    """Partición más cercana de cada fila, por bloques para no cargar toda la matriz."""
+    assign = np.empty(len(emb), dtype=np.int32)
+    for start in range(0, len(emb), chunk):
+        block = np.asarray(emb[start:start + chunk], dtype=np.float32)
+        assign[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+def build_ivf(index_dir: Path, n: int, dim: int):
+    """Entrena centroides y reordena embeddings y row_ids por partición."""
+    emb = np.memmap(index_dir / "embeddings.f16", dtype=np.float16, mode="r", shape=(n, dim))
+    row_ids = np.load(index_dir / "row_ids.npy")
+
+    nlist = int(4 * np.sqrt(n))
+    rng = np.random.default_rng(SEED)
+    sample_idx = np.sort(rng.choice(n, min(n, KMEANS_SAMPLE), replace=False))
+    sample = np.asarray(emb[sample_idx], dtype=np.float32)
+    print(f"Entrenando IVF: {nlist} particiones con {len(sample)} muestras")
+    centroids = train_centroids(sample, nlist)
+
+    assign = assign_lists(emb, centroids)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+
+    tmp_path = index_dir / "embeddings.f16.tmp"
+    out = np.memmap(tmp_path, dtype=np.float16, mode="w+", shape=(n, dim))
+    for start in range(0, n, SEARCH_CHUNK):
+        idx = order[start:start + SEARCH_CHUNK]
+        out[start:start + len(idx)] = emb[np.sort(idx)][np.argsort(np.argsort(idx))]
+    out.flush()
+    del out, emb
+    os.replace(tmp_path, index_dir / "embeddings.f16")
+
+    np.save(index_dir / "row_ids.npy", row_ids[order])
+    np.save(index_dir / "centroids.npy", centroids.astype(np.float32))
+    np.save(index_dir / "list_offsets.npy", offsets.astype(np.int64))
+    return nlist
+
+def build_index(csv_path: Path, index_dir: Path = INDEX_DIR, batch_size: int = 64):
+    """Extrae y guarda los embeddings de todas las filas válidas del inventario."""
+    from tensorflow.keras.models import load_model
+
+    df = read_inventory(csv_path, columns=["relative_path"], valid_only=True)
+    print(f"Extrayendo embeddings de {len(df)} filas de {csv_path}")
+
+    embedder = make_embedder(load_model(MODEL_PATH))
+    dim = int(embedder.output_shape[-1])
+
+    if index_dir.exists():
+        shutil.rmtree(index_dir)
+    index_dir.mkdir(parents=True)
+
+    # Escritura incremental: la memoria no depende del tamaño del inventario
+    row_ids = []
+    with open(index_dir / "embeddings.f16", "wb") as f:
+        for start in range(0, len(df), batch_size):
+            chunk = df.iloc[start:start + batch_size]
+            batch, valid = load_batch([str(ROOT.parent / p) for p in chunk["relative_path"]])
+            if not valid:
+                continue
+            f.write(embed_batch(embedder, batch).astype(np.float16).tobytes())
+            row_ids.extend(chunk.index[valid].tolist())
+            print(f"  {start + len(chunk)}/{len(df)}")
+
+    n = len(row_ids)
+    if n == 0:
+        # Sin meta.json la app no intenta cargar el índice
+        print("❌ No se pudo leer ninguna fila del inventario: no se guarda el índice")
+        return None
+    np.save(index_dir / "row_ids.npy", np.asarray(row_ids, dtype=np.int64))
+
+    meta = {"n": n, "dim": dim, "kind": "flat", "csv": str(csv_path), **inventory_signature(csv_path)}
+    if n >= IVF_MIN_ROWS:
+        meta["kind"] = "ivf"
+        meta["nlist"] = build_ivf(index_dir, n, dim)
+    with open(index_dir / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Índice '{meta['kind']}' guardado en {index_dir} ({n} x {dim} float16)")
+    return meta
+
+class EmbeddingIndex:
+    """Índice en disco de solo lectura con búsqueda top-k por similitud coseno."""
+
+    def __init__(self, index_dir: Path = INDEX_DIR):
+        index_dir = Path(index_dir)
+        with open(index_dir / "meta.json", "r") as f:
+            self.meta = json.load(f)
+        n, dim = self.meta["n"], self.meta["dim"]
+        if n == 0:
+            # np.memmap no admite ficheros vacíos (índices antiguos construidos sin filas)
+            self.emb = np.zeros((0, dim), dtype=np.float16)
+        else:
+            self.emb = np.memmap(index_dir / "embeddings.f16", dtype=np.float16, mode="r", shape=(n, dim))
+        self.row_ids = np.load(index_dir / "row_ids.npy")
+        self.centroids = None
+        if self.meta["kind"] == "ivf":
+            self.centroids = np.load(index_dir / "centroids.npy")
+            self.offsets = np.load(index_dir / "list_offsets.npy")
+
+    def __len__(self):
+        return self.meta["n"]
+
+    def is_stale(self):
+        """
+        True si el inventario cambió desde que se construyó el índice (los row_id ya no
+        apuntan a las mismas filas) o si el índice no registra con qué inventario se hizo.
+        """
+        keys = ("inventory_file", "inventory_mtime", "inventory_rows")
+        if any(k not in self.meta for k in keys):
+            return True
+        try:
+            current = inventory_signature(self.meta["csv"])
+        except (OSError, ValueError):
+            return True
+        return any(current[k] != self.meta[k] for k in keys)
+
+    def _ranges(self, query, nprobe: int):
+        """Rangos contiguos [inicio, fin) a recorrer para la consulta."""
+        if self.centroids is None:
+            return [(0, len(self))]
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        return [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in np.sort(probes)]
+
+    def search(self, query, k: int = 10, nprobe: int = DEFAULT_NPROBE):
+        """Devuelve [(row_id, score), ...] ordenados de mayor a menor similitud."""
+        query = l2_normalize(query).reshape(-1)
+        best_scores = np.zeros(0, dtype=np.float32)
+        best_pos = np.zeros(0, dtype=np.int64)
+        for lo, hi in self._ranges(query, nprobe):
+            for start in range(lo, hi, SEARCH_CHUNK):
+                stop = min(hi, start + SEARCH_CHUNK)
+                scores = np.asarray(self.emb[start:stop], dtype=np.float32) @ query
+                best_scores = np.concatenate([best_scores, scores])
+                best_pos = np.concatenate([best_pos, np.arange(start, stop)])
+                if len(best_scores) > k:
+                    keep = np.argpartition(-best_scores, k)[:k]
+                    best_scores, best_pos = best_scores[keep], best_pos[keep]
+        order = np.argsort(-best_scores)
+        return [(int(self.row_ids[best_pos[i]]), float(best_scores[i])) for i in order]
+
+def lookup_rows(csv_path, results):
+    """Añade a los resultados las columnas del inventario correspondientes a cada row_id."""
+    # Solo se leen las k filas de los resultados, no el inventario entero
+    df = read_inventory(csv_path, columns=["category", "split", "relative_path"],
+                        ids=[row_id for row_id, _ in results])
+    # reindex: una fila que ya no existe vuelve como NaN en vez de lanzar KeyError
+    rows = df.reindex([row_id for row_id, _ in results])
+    rows.insert(0, "score", [score for _, score in results])
+    return rows.reset_index(names="row_id")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice de embeddings EfficientNetB3 para búsqueda por similitud.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Extrae embeddings del inventario y construye el índice")
+    p_build.add_argument("--csv", default="data/inventory.csv", help="Inventario (default: data/inventory.csv)")
+    p_build.add_argument("--batch_size", type=int, default=64, help="Tamaño de batch (default: 64)")
+
+    p_search = sub.add_parser("search", help="Busca los elementos del inventario más parecidos a una imagen")
+    p_search.add_argument("--image", required=True, help="Imagen de consulta")
+    p_search.add_argument("--k", type=int, default=10, help="Número de resultados (default: 10)")
+    p_search.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="Particiones IVF a recorrer (default: 8)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        time_start = time.perf_counter()
+        build_index(ROOT.parent / args.csv, batch_size=args.batch_size)
+        print(f"\n✅ Índice construido en {time.perf_counter() - time_start:.1f} s")
+    else:
+        from tensorflow.keras.models import load_model
+
+        index = EmbeddingIndex()
+        if index.is_stale():
+            print("❌ El inventario cambió desde que se construyó el índice: ejecuta 'build' de nuevo")
+            sys.exit(1)
+        batch, valid = load_batch([args.image])
+        if not valid:
+            sys.exit(1)
+        query = embed_batch(make_embedder(load_model(MODEL_PATH)), batch)[0]
+
+        time_start = time.perf_counter()
+        results = index.search(query, k=args.k, nprobe=args.nprobe)
+        elapsed_ms = 1000 * (time.perf_counter() - time_start)
+
+        rows = lookup_rows(index.meta["csv"], results)
+        print(rows[["row_id", "score", "category", "split", "relative_path"]].to_string(index=False))
+        print(f"\nBúsqueda ({index.meta['kind']}, {len(index)} filas): {elapsed_ms:.1f} ms")
@@ -3,6 +3,8 @@
 extract_frames_and_inventory.py
 - Instalar ffmpeg/ffprobe en python: pip install ffmpeg-python
 - Ejecutar: python extract_frames_and_inventory.py --root data --csv inventory.csv --change_names True
+- Muestreo por planos: --sampling shots --frames_per_video 5 detecta los cambios de plano
+  (shot_sampler.py) y extrae frames representativos de cada plano en vez de la tabla fija.
 - Lee estructura: <root>/<categoria>/* (acepta múltiples extensiones de vídeo e imagen)
 - Si una categoría tiene vídeos, crea <root>/<categoria>/frames/ y extrae hasta 3 frames por vídeo:
     * si duration < 4.0s -> timestamps = [0, 2, 3]
@@ -12,6 +14,14 @@ extract_frames_and_inventory.py
     category, source_type (video|image), filename, timestamps_extracted, output_path, split
   Incluye en el CSV también las imágenes existentes en cada categoría (cualquier extensión),
   con source_type="image" y split="image".
+- Tamaño y codificación de los frames: --frame_size 320 --frame_mode fit|exact
+  --frame_format jpg|webp --frame_quality 85 reduce los frames al extraerlos (fit: lado corto
+  = frame_size conservando el aspecto; exact: frame_size x frame_size, la entrada del modelo).
+  Los ajustes usados se registran en el inventario (frame_quality es el valor que recibe el
+  codificador: -q:v 2-31 en jpg, -quality 0-100 en webp). Por defecto: resolución original,
+  jpg -q:v 2.
+- El inventario se escribe de forma incremental en <root>/inventory.sqlite (indexado por
+  category, split y source_type) y en el CSV de compatibilidad (ver inventory_store.py).
 - Requiere ffmpeg y ffprobe en PATH.
 """
 from pathlib import Path
@@ -24,13 +34,14 @@ import sys
 sys.dont_write_bytecode = True
 
 import generate_zip_data
+import shot_sampler
+import inventory_store
 import subprocess
 import argparse
+import hashlib
 import shutil
 import random
 import time
-import json
-import csv
 import os
 
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
@@ -51,11 +62,37 @@ SEED = 42
 
 corrupted_images = []
 
-def is_video_file(p: Path):
-    return p.is_file() and p.suffix.lower() in VIDEO_EXTS
-
-def is_image_file(p: Path):
-    return p.is_file() and p.suffix.lower() in IMAGE_EXTS
+def file_kind(name: str):
+    """'video', 'image' o None según la extensión (sin tocar el disco)."""
+    ext = os.path.splitext(name)[1].lower()
+    if ext in VIDEO_EXTS:
+        return 'video'
+    if ext in IMAGE_EXTS:
+        return 'image'
+    return None
+
+def scan_dirs(directory):
+    """Subdirectorios de directory ordenados por nombre (os.DirEntry)."""
+    with os.scandir(directory) as it:
+        return sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+
+def scan_files(directory, recursive: bool = False, skip_dirs=("frames",)):
+    """
+    Generador perezoso de ficheros (os.DirEntry) bajo directory con os.scandir.
+    - Orden determinista: las entradas de cada directorio se ordenan por nombre; solo se
+      materializa el directorio en curso, nunca el árbol completo.
+    - is_file()/is_dir() usan el tipo cacheado de la entrada: no hay un stat por fichero.
+    - Con recursive=True desciende a subcarpetas, salvo skip_dirs ('frames' es salida
+      de ejecuciones anteriores).
+    """
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if recursive and entry.name not in skip_dirs:
+                yield from scan_files(entry.path, recursive, skip_dirs)
+        elif entry.is_file():
+            yield entry
 
 # Filtrar imágenes corruptas. 
 # No almacenamos aquellas imagenes corruptas en la lista de imagenes para la categoría
@@ -76,42 +113,45 @@ def is_valid_image(p: Path):
 
     return is_jfif
 
-def gather_category_files(root: Path, change_names: bool):
+def gather_category_files(root: Path, change_names: bool, recursive: bool = False):
     """
-    Recorre root y devuelve dict:
-      { category_path: {'videos':[Path,...], 'images':[Path,...]} , ... }
+    Recorre root con una sola pasada de os.scandir por categoría y genera
+      (category_path, {'videos':[Path,...], 'images':[Path,...]})
+    categoría a categoría, para que el procesado empiece sin listar todo el árbol.
     Solo incluye directorios que contengan al menos videos or images (images are included
-    even if there are no videos).
+    even if there are no videos). Con recursive=True incluye subcarpetas anidadas.
     """
-    cats = {}
     if not root.exists():
-        return cats
-    for cat in sorted(root.iterdir()):
-        if not cat.is_dir():
-            continue
-        videos = [p for p in sorted(cat.iterdir()) if is_video_file(p)]
+        return
+    for cat_entry in scan_dirs(root):
+        cat = Path(cat_entry.path)
+        videos = []
+        images = []
+        for entry in scan_files(cat, recursive):
+            kind = file_kind(entry.name)
+            if kind == 'video':
+                videos.append(Path(entry.path))
+            elif kind == 'image' and is_valid_image(Path(entry.path)):
+                images.append(Path(entry.path))
 
         # Si queremos cambiar el nombre de las imagenes (change_names vendría a True) 
         # Recorremos todas las imagenes en la carpeta de la categoría y cambiamos el nombre de cada una para que se componga de
         # el nombre de la categoría seguido de un guion y un numero aleatorio
         if change_names:
             print(f"  Cambiando nombres de las imagenes de la categoria {cat.name}")
-            images = [p for p in sorted(cat.iterdir()) if is_image_file(p) if is_valid_image(p)]
             change = random.randint(1, 50)
-            contador = 1
-            for img in images:
-                name_image = img.name
-                base_name, ext = os.path.splitext(img)
-                name_image = f"{cat.name}{change}_{contador:04d}{ext}"
+            renamed = []
+            for contador, img in enumerate(images, start=1):
+                name_image = f"{cat.name}{change}_{contador:04d}{img.suffix}"
                 new_path = img.parent / name_image
                 img.rename(new_path)
-                contador += 1
+                renamed.append(new_path)
+            # mismo orden que un listado nuevo de la carpeta
+            images = sorted(renamed)
 
-        images = [p for p in sorted(cat.iterdir()) if is_image_file(p) if is_valid_image(p)]
         # include categories that have either images or videos
         if videos or images:
-            cats[cat] = {'videos': videos, 'images': images}
-    return cats
+            yield cat, {'videos': videos, 'images': images}
 
 def get_duration_seconds(video_path: Path):
     """Devuelve duración en segundos (float) usando ffprobe. 0.0 si error."""
@@ -137,10 +177,43 @@ def cap_timestamp(ts: float, duration: float):
         return 0.0
     return min(ts, max(0.0, duration - eps))
 
-def extract_frame_at_timestamp(video_path: Path, timestamp: float, out_path: Path):
+def jpeg_qscale(quality):
+    """Calidad 1-100 -> -q:v de ffmpeg (31 peor, 2 mejor). None -> 2 (calidad jpeg razonable)."""
+    if quality is None:
+        return 2
+    return int(min(31, max(2, round(2 + (100 - quality) * 29 / 99))))
+
+def encoder_quality(frame_format="jpg", frame_quality=None):
+    """
+    Valor de calidad que recibe realmente el codificador (el que se registra en el inventario):
+    webp -> -quality de libwebp (0-100, 80 por defecto); jpg -> -q:v de ffmpeg (2-31).
+    """
+    if frame_format == "webp":
+        return frame_quality if frame_quality is not None else 80
+    return jpeg_qscale(frame_quality)
+
+def frame_encoding_args(frame_size=None, frame_mode="fit", frame_format="jpg", frame_quality=None):
+    """Argumentos de ffmpeg para escalar y codificar el frame extraído."""
+    args = []
+    if frame_size:
+        if frame_mode == "exact":
+            vf = f"scale={frame_size}:{frame_size}"
+        else:
+            # lado corto = frame_size (nunca amplía), conservando la relación de aspecto
+            vf = (f"scale='if(gt(iw,ih),-2,min({frame_size},iw))'"
+                  f":'if(gt(iw,ih),min({frame_size},ih),-2)'")
+        args += ["-vf", vf]
+    if frame_format == "webp":
+        args += ["-c:v", "libwebp", "-quality", str(encoder_quality("webp", frame_quality))]
+    else:
+        args += ["-q:v", str(encoder_quality("jpg", frame_quality))]
+    return args
+
+def extract_frame_at_timestamp(video_path: Path, timestamp: float, out_path: Path, frame_opts: dict = None):
     """
     Extrae un frame con ffmpeg en timestamp (segundos).
     Usa -ss antes de -i para posicionamiento rápido.
+    frame_opts: frame_size, frame_mode, frame_format, frame_quality (ver frame_encoding_args).
     """
     ensure_dir(out_path.parent)
     cmd = [
@@ -150,7 +223,7 @@ def extract_frame_at_timestamp(video_path: Path, timestamp: float, out_path: Pat
         "-ss", str(timestamp),
         "-i", str(video_path),
         "-frames:v", "1",
-        "-q:v", "2",   # calidad jpeg razonable
+        *frame_encoding_args(**(frame_opts or {})),
         "-y",          # sobrescribir si existe
         str(out_path)
     ]
@@ -241,11 +314,37 @@ def split_elements_by_ratio(image_paths):
 
     return {'train': train_imgs, 'val': val_imgs, 'test': test_imgs}
 
-def process(root: Path, csv_out: Path, change_names: bool):
+def frame_base_name(vid_path: Path, cat_path: Path):
+    """
+    Base del nombre de los frames de un vídeo. Con --recursive dos vídeos de subcarpetas
+    distintas pueden compartir nombre (a/clip.mp4, b/clip.mp4): a los de subcarpetas se les
+    añade un hash corto de la subcarpeta para que sus frames no se sobrescriban.
+    """
+    subdir = vid_path.parent.relative_to(cat_path)
+    if subdir == Path("."):
+        return vid_path.stem
+    digest = hashlib.sha1(subdir.as_posix().encode("utf-8")).hexdigest()[:8]
+    return f"{vid_path.stem}_{digest}"
+
+def video_timestamps(vid_path: Path, duration: float, sampling: str, frames_per_video: int):
+    """
+    Timestamps a extraer de un vídeo según el modo de muestreo:
+    - fixed -> tabla fija por duración (timestamps_choice)
+    - shots -> frames representativos por plano, con timestamps_choice como respaldo
+    """
+    if sampling == "shots":
+        ts_list = shot_sampler.shot_timestamps(vid_path, frames_per_video)
+        if ts_list:
+            return [cap_timestamp(t, duration) for t in ts_list]
+    return timestamps_choice(duration)
+
+def process(root: Path, csv_out: Path, change_names: bool, sampling: str = "fixed", frames_per_video: int = 3,
+            recursive: bool = False, frame_opts: dict = None):
     ROOT = Path(__file__).resolve().parent  # -> TFM/
     data = root
     root = ROOT.parent / data
     csv_out = root / csv_out
+    db_out = inventory_store.db_path_for(csv_out)
 
     if not root.exists():
         print("No existe el directorio", root)
@@ -258,105 +357,123 @@ def process(root: Path, csv_out: Path, change_names: bool):
     # Si el fichero inventario.csv ya existe, lo borramos
     if os.path.exists(csv_out):
         os.remove(csv_out)
+    if os.path.exists(db_out):
+        os.remove(db_out)
     
-    cats = gather_category_files(root, change_names)
-    if not cats:
-        print("No se encontraron categorías con vídeos ni imágenes en", root)
-        return
-
-    # Prepara CSV
-    csv_fieldnames = ['category', 'source_type', 'filename', 'timestamps_extracted', 'output_path', 'relative_path', 'split']
-    csv_rows = []
-
-    for cat_path, contents in cats.items():
-        videos = contents['videos']
-        images = contents['images']
-        relative_path = cat_path
-        # Solo crear frames dir si hay videos en la categoría (requisito)
-        # Eliminar primero directorio frames si ya existe
-        frames_dir = cat_path / "frames"
-        if frames_dir.is_dir():
-            rmtree(frames_dir)
-        frames_root = frames_dir if videos else None
-
-        if frames_root is not None:
-            ensure_dir(frames_root)
-            print(f"Categoria '{cat_path.name}': {len(videos)} videos, {len(images)} imágenes -> frames en {frames_root}")
-        else:
-            print(f"Categoria '{cat_path.name}': {len(videos)} videos, {len(images)} imágenes -> NO se crea 'frames' (no hay videos)")
-
-        # Primero procesar VIDEOS (si los hay), extrayendo dataframes
-        vid_splits = split_elements_by_ratio(videos)
-        for split_name in SPLITS:
-            for vid_path in vid_splits[split_name]:
-            #for vid in videos:
-                duration = get_duration_seconds(vid_path)
-                ts_list = timestamps_choice(duration)
-                video_base = vid_path.stem
-                print(f"  Procesando video: {vid_path.name} (dur={duration:.2f}s) -> timestamps: {ts_list}")
-
-                # Por cada timestamp, extraer y asignar split en orden
-                for idx, ts in enumerate(ts_list):
-                    out_dir = frames_root / split_name
-                    ensure_dir(out_dir)
-                    out_fname = out_dir / f"frame_{video_base}_{idx+1:06d}.jpg"
-                    relative_path = data / out_fname.relative_to(root)
-                    success = extract_frame_at_timestamp(vid_path, ts, out_fname)
-                    out_path_str = str(out_fname.resolve()) if success else ""
-                    # Guardar fila CSV por cada frame intentado (si falló se registra path vacío)
-                    csv_rows.append({
+    frame_opts = frame_opts or {}
+    frame_ext = "webp" if frame_opts.get('frame_format') == "webp" else "jpg"
+    # Ajustes de codificación registrados en cada fila de frame
+    frame_meta = {
+        'frame_size': frame_opts.get('frame_size'),
+        'frame_mode': frame_opts.get('frame_mode') if frame_opts.get('frame_size') else None,
+        'frame_format': frame_ext,
+        'frame_quality': encoder_quality(frame_ext, frame_opts.get('frame_quality')),
+    }
+
+    # Prepara inventario (SQLite + CSV), escrito por lotes a medida que se generan filas.
+    # El with garantiza el último lote y los índices aunque la extracción falle a medias.
+    n_cats = 0
+    with inventory_store.InventoryWriter(db_out, csv_out) as writer:
+        for cat_path, contents in gather_category_files(root, change_names, recursive):
+            n_cats += 1
+            videos = contents['videos']
+            images = contents['images']
+            relative_path = cat_path
+            # Solo crear frames dir si hay videos en la categoría (requisito)
+            # Eliminar primero directorio frames si ya existe
+            frames_dir = cat_path / "frames"
+            if frames_dir.is_dir():
+                rmtree(frames_dir)
+            frames_root = frames_dir if videos else None
+
+            if frames_root is not None:
+                ensure_dir(frames_root)
+                print(f"Categoria '{cat_path.name}': {len(videos)} videos, {len(images)} imágenes -> frames en {frames_root}")
+            else:
+                print(f"Categoria '{cat_path.name}': {len(videos)} videos, {len(images)} imágenes -> NO se crea 'frames' (no hay videos)")
+
+            # Primero procesar VIDEOS (si los hay), extrayendo dataframes
+            vid_splits = split_elements_by_ratio(videos)
+            for split_name in SPLITS:
+                for vid_path in vid_splits[split_name]:
+                #for vid in videos:
+                    duration = get_duration_seconds(vid_path)
+                    ts_list = video_timestamps(vid_path, duration, sampling, frames_per_video)
+                    video_base = frame_base_name(vid_path, cat_path)
+                    print(f"  Procesando video: {vid_path.name} (dur={duration:.2f}s) -> timestamps: {ts_list}")
+
+                    # Por cada timestamp, extraer y asignar split en orden
+                    for idx, ts in enumerate(ts_list):
+                        out_dir = frames_root / split_name
+                        ensure_dir(out_dir)
+                        out_fname = out_dir / f"frame_{video_base}_{idx+1:06d}.{frame_ext}"
+                        relative_path = data / out_fname.relative_to(root)
+                        success = extract_frame_at_timestamp(vid_path, ts, out_fname, frame_opts)
+                        out_path_str = str(out_fname.resolve()) if success else ""
+                        # Guardar fila por cada frame intentado (si falló se registra path vacío)
+                        writer.add({
+                            'category': cat_path.name,
+                            'source_type': 'video',
+                            'filename': vid_path.name,
+                            'timestamp': ts,  # en el CSV se guarda como JSON list de 1
+                            'output_path': out_path_str,
+                            'relative_path': relative_path,
+                            'split': split_name,
+                            **frame_meta,
+                        })
+                        if success:
+                            print(f"    - {split_name}: {out_fname.name}  (t={ts:.3f}s)")
+                        else:
+                            print(f"    !! fallo extrayendo (t={ts:.3f}s) de {vid_path.name}")
+
+            # Luego agregar imágenes existentes en la categoría al CSV (no crear frames por esto)
+            # antes de iterar imágenes en una categoría:
+            img_splits = split_elements_by_ratio(images)
+
+            for split_name in SPLITS:
+                for img_path in img_splits[split_name]:
+                    relative_path = data / img_path.relative_to(root)
+                    writer.add({
                         'category': cat_path.name,
-                        'source_type': 'video',
-                        'filename': vid_path.name,
-                        'timestamps_extracted': json.dumps([round(ts, 3)]),  # guardamos el timestamp de este frame como JSON list de 1
-                        'output_path': out_path_str,
+                        'source_type': 'image',
+                        'filename': img_path.name,
+                        'timestamp': None,
+                        'output_path': str(img_path.resolve()),
                         'relative_path': relative_path,
                         'split': split_name
                     })
-                    if success:
-                        print(f"    - {split_name}: {out_fname.name}  (t={ts:.3f}s)")
-                    else:
-                        print(f"    !! fallo extrayendo (t={ts:.3f}s) de {vid_path.name}")
-
-        # Luego agregar imágenes existentes en la categoría al CSV (no crear frames por esto)
-        # antes de iterar imágenes en una categoría:
-        img_splits = split_elements_by_ratio(images)
-
-        for split_name in SPLITS:
-            for img_path in img_splits[split_name]:
-                relative_path = data / img_path.relative_to(root)
-                csv_rows.append({
-                    'category': cat_path.name,
-                    'source_type': 'image',
-                    'filename': img_path.name,
-                    'timestamps_extracted': '',
-                    'output_path': str(img_path.resolve()),
-                    'relative_path': relative_path,
-                    'split': split_name
-                })
-
-    # Escribir CSV
-    ensure_dir(root)
-    
-    with open(f"{csv_out}", 'w', newline='', encoding='utf-8') as f:
-    #with open(f"{root}/{csv_out}", 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=csv_fieldnames)
-        writer.writeheader()
-        for row in csv_rows:
-            writer.writerow(row)
 
-    print(f"\nCSV generado en: {csv_out}  (filas: {len(csv_rows)})")
+    if n_cats == 0:
+        print("No se encontraron categorías con vídeos ni imágenes en", root)
+        return
+
+    print(f"\nInventario generado en: {db_out}  (filas: {writer.count})")
+    print(f"CSV generado en: {csv_out}  (filas: {writer.count})")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extrae frames (3 por vídeo) y genera CSV inventario (incluye imágenes).")
     parser.add_argument("--root", default="data", help="Directorio raíz con subcarpetas por categoría (default: data)")
     parser.add_argument("--csv", default="inventory.csv", help="Ruta CSV de salida (default: inventory.csv)")
     parser.add_argument("--change_names", default=False, help="Indica si quiere que se cambien los nombres de la s imagenes (default: true)")
+    parser.add_argument("--sampling", default="fixed", choices=["fixed", "shots"], help="Muestreo de frames: tabla fija o por planos (default: fixed)")
+    parser.add_argument("--frames_per_video", type=int, default=3, help="Presupuesto de frames por vídeo con --sampling shots (default: 3)")
+    parser.add_argument("--recursive", action="store_true", help="Incluye ficheros de subcarpetas anidadas de cada categoría")
+    parser.add_argument("--frame_size", type=int, default=None, help="Reduce los frames extraídos a este tamaño (default: resolución original)")
+    parser.add_argument("--frame_mode", default="fit", choices=["fit", "exact"], help="fit: lado corto = frame_size con el aspecto original; exact: frame_size x frame_size (default: fit)")
+    parser.add_argument("--frame_format", default="jpg", choices=["jpg", "webp"], help="Formato de los frames (default: jpg)")
+    parser.add_argument("--frame_quality", type=int, default=None, help="Calidad 1-100 (default: jpg -q:v 2, webp 80)")
     args = parser.parse_args()
     
     time_start = time.perf_counter()
 
-    process(Path(args.root), Path(args.csv), args.change_names)
+    frame_opts = {
+        'frame_size': args.frame_size,
+        'frame_mode': args.frame_mode,
+        'frame_format': args.frame_format,
+        'frame_quality': args.frame_quality,
+    }
+    process(Path(args.root), Path(args.csv), args.change_names, args.sampling, args.frames_per_video, args.recursive,
+            frame_opts)
 
     # Generar ZIP de data
     generate_zip_data.main()
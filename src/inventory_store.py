@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+inventory_store.py
+- Inventario en SQLite (<root>/inventory.sqlite) con índices sobre category, split y
+  source_type, junto al inventory.csv de siempre (compatibilidad).
+- InventoryWriter escribe las filas por lotes a medida que se generan (SQLite y CSV a la
+  vez), así la memoria durante la construcción no depende del tamaño del dataset.
+- Los frames extraídos de vídeo registran cómo se codificaron (frame_size, frame_mode,
+  frame_format, frame_quality); en las imágenes originales esas columnas van vacías.
+  frame_quality es el valor que recibió el codificador: -q:v de ffmpeg (2-31, menor es
+  mejor) en jpg y -quality de libwebp (0-100) en webp.
+- El id de cada fila es su posición (0-based) en inventory.csv, igual que el índice que
+  asigna pandas al leer el CSV.
+- read_inventory(...) carga solo las columnas y particiones pedidas. Acepta la ruta del CSV:
+  si existe el .sqlite hermano lo usa, si no lee el CSV. En ambos casos devuelve el esquema
+  de la base de datos (columna 'timestamp' float en vez de 'timestamps_extracted').
+- Ejecutar:
+    python inventory_store.py export --db data/inventory.sqlite --csv data/inventory.csv
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import pandas as pd
+import argparse
+import sqlite3
+import json
+import csv
+import os
+
+# Columnas del CSV de compatibilidad (mismo orden que el inventory.csv original + ajustes de frame)
+FRAME_COLUMNS = ['frame_size', 'frame_mode', 'frame_format', 'frame_quality']
+CSV_FIELDNAMES = ['category', 'source_type', 'filename', 'timestamps_extracted', 'output_path', 'relative_path', 'split'] + FRAME_COLUMNS
+
+SCHEMA = """
+CREATE TABLE inventory (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    source_type TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    timestamp REAL,
+    output_path TEXT NOT NULL,
+    relative_path TEXT NOT NULL,
+    split TEXT NOT NULL,
+    frame_size INTEGER,
+    frame_mode TEXT,
+    frame_format TEXT,
+    frame_quality INTEGER
+)
+"""
+INDEXES = [
+    "CREATE INDEX idx_inventory_category ON inventory (category)",
+    "CREATE INDEX idx_inventory_split ON inventory (split)",
+    "CREATE INDEX idx_inventory_source_type ON inventory (source_type)",
+]
+DB_COLUMNS = ['id', 'category', 'source_type', 'filename', 'timestamp', 'output_path', 'relative_path', 'split'] + FRAME_COLUMNS
+PARTITION_COLUMNS = ('category', 'split', 'source_type')
+
+def db_path_for(csv_path: Path):
+    """Ruta del .sqlite asociado a un inventory.csv."""
+    return Path(csv_path).with_suffix(".sqlite")
+
+class InventoryWriter:
+    """
+    Escritor incremental del inventario. Uso:
+        with InventoryWriter(db_path, csv_path) as writer:
+            writer.add({...})
+    Cada fila lleva las columnas de DB_COLUMNS salvo 'id'; 'timestamp' es float o None (se
+    guarda redondeado a milisegundos) y las columnas de FRAME_COLUMNS son opcionales.
+    """
+
+    def __init__(self, db_path: Path, csv_path: Path = None, batch_size: int = 1000):
+        self.db_path = Path(db_path)
+        self.batch_size = batch_size
+        self.count = 0
+        self._buffer = []
+
+        if self.db_path.exists():
+            os.remove(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute(SCHEMA)
+
+        self._csv_file = None
+        self._csv_writer = None
+        if csv_path is not None:
+            self._csv_file = open(csv_path, 'w', newline='', encoding='utf-8')
+            self._csv_writer = csv.DictWriter(self._csv_file, fieldnames=CSV_FIELDNAMES)
+            self._csv_writer.writeheader()
+
+    def add(self, row: dict):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        records = []
+        for offset, row in enumerate(self._buffer):
+            ts = row.get('timestamp')
+            # Misma precisión en SQLite y en el CSV: read_inventory devuelve lo mismo desde ambos
+            ts = round(float(ts), 3) if ts is not None else None
+            records.append((
+                self.count + offset,
+                row['category'],
+                row['source_type'],
+                row['filename'],
+                ts,
+                str(row['output_path']),
+                str(row['relative_path']),
+                row['split'],
+                *(row.get(c) for c in FRAME_COLUMNS),
+            ))
+            if self._csv_writer is not None:
+                self._csv_writer.writerow({
+                    'category': row['category'],
+                    'source_type': row['source_type'],
+                    'filename': row['filename'],
+                    # El CSV conserva el formato original: lista JSON con el timestamp del frame
+                    'timestamps_extracted': json.dumps([round(ts, 3)]) if ts is not None else '',
+                    'output_path': row['output_path'],
+                    'relative_path': row['relative_path'],
+                    'split': row['split'],
+                    **{c: row.get(c) if row.get(c) is not None else '' for c in FRAME_COLUMNS},
+                })
+        self.conn.executemany(
+            f"INSERT INTO inventory ({', '.join(DB_COLUMNS)}) VALUES ({', '.join('?' * len(DB_COLUMNS))})",
+            records,
+        )
+        self.conn.commit()
+        self.count += len(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        # Los índices se crean al final: la inserción masiva es más rápida sin ellos
+        for stmt in INDEXES:
+            self.conn.execute(stmt)
+        self.conn.commit()
+        self.conn.close()
+        if self._csv_file is not None:
+            self._csv_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def load_inventory(db_path: Path, columns=None, valid_only: bool = False, id_range=None, ids=None,
+                   **partitions):
+    """
+    Carga el inventario desde SQLite como DataFrame indexado por id.
+    columns: lista de columnas (None -> todas)
+    valid_only: descarta frames cuya extracción falló (output_path vacío)
+    id_range: (inicio, fin) -> solo filas con inicio <= id < fin
+    ids: lista de ids concretos (p. ej. resultados de una búsqueda)
+    partitions: category/split/source_type = valor o lista de valores
+    """
+    cols = [c for c in (columns or DB_COLUMNS) if c != 'id']
+    where, params = [], []
+    for key, value in partitions.items():
+        if value is None:
+            continue
+        if key not in PARTITION_COLUMNS:
+            raise ValueError(f"Partición no soportada: {key}")
+        values = [value] if isinstance(value, str) else list(value)
+        where.append(f"{key} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    if valid_only:
+        where.append("output_path != ''")
+    if id_range is not None:
+        where.append("id >= ? AND id < ?")
+        params.extend(int(v) for v in id_range)
+    if ids is not None:
+        ids = [int(v) for v in ids]
+        where.append(f"id IN ({', '.join('?' * len(ids))})" if ids else "0")
+        params.extend(ids)
+
+    query = f"SELECT id, {', '.join(cols)} FROM inventory"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY id"
+
+    with sqlite3.connect(db_path) as conn:
+        df = pd.read_sql_query(query, conn, params=params, index_col='id')
+    df.index.name = None
+    return df
+
+def csv_timestamp(value):
+    """'[2.0]' (formato del CSV) -> 2.0; vacío -> NaN, como el NULL de SQLite."""
+    if not isinstance(value, str) or not value.strip():
+        return float('nan')
+    values = json.loads(value)
+    return float(values[0]) if values else float('nan')
+
+def read_inventory(path: Path, columns=None, valid_only: bool = False, id_range=None, ids=None,
+                   **partitions):
+    """
+    Carga el inventario desde path (.csv o .sqlite). Con un .csv se usa el .sqlite hermano
+    si existe; si no, se lee el CSV (solo las columnas pedidas) y se filtra en memoria.
+    """
+    path = Path(path)
+    db_path = path if path.suffix == ".sqlite" else db_path_for(path)
+    if db_path.exists():
+        return load_inventory(db_path, columns, valid_only, id_range, ids, **partitions)
+
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(list(columns) + [k for k, v in partitions.items() if v is not None]
+                                     + (['output_path'] if valid_only else [])))
+        usecols = ['timestamps_extracted' if c == 'timestamp' else c for c in usecols]
+    df = pd.read_csv(path, usecols=usecols)
+    if 'timestamps_extracted' in df.columns:
+        df = df.rename(columns={'timestamps_extracted': 'timestamp'})
+        df['timestamp'] = df['timestamp'].map(csv_timestamp)
+    if columns is None:
+        df = df[[c for c in DB_COLUMNS if c in df.columns]]
+    for key, value in partitions.items():
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        df = df[df[key].isin(values)]
+    if valid_only:
+        df = df[df['output_path'].notna() & (df['output_path'] != '')]
+    if id_range is not None:
+        df = df[(df.index >= id_range[0]) & (df.index < id_range[1])]
+    if ids is not None:
+        df = df[df.index.isin([int(v) for v in ids])]
+    return df[columns] if columns is not None else df
+
+def export_csv(db_path: Path, csv_path: Path, chunk_size: int = 10000):
+    """Vuelca el inventario SQLite a CSV (formato original) por bloques."""
+    with sqlite3.connect(db_path) as conn, open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
+        writer.writeheader()
+        cursor = conn.execute(
+            "SELECT category, source_type, filename, timestamp, output_path, relative_path, split, "
+            f"{', '.join(FRAME_COLUMNS)} FROM inventory ORDER BY id"
+        )
+        count = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for category, source_type, filename, ts, output_path, relative_path, split, *frame in rows:
+                writer.writerow({
+                    'category': category,
+                    'source_type': source_type,
+                    'filename': filename,
+                    'timestamps_extracted': json.dumps([round(ts, 3)]) if ts is not None else '',
+                    'output_path': output_path,
+                    'relative_path': relative_path,
+                    'split': split,
+                    **{c: v if v is not None else '' for c, v in zip(FRAME_COLUMNS, frame)},
+                })
+            count += len(rows)
+    print(f"CSV exportado en: {csv_path}  (filas: {count})")
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Utilidades del inventario SQLite.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Exporta el inventario SQLite a CSV")
+    p_export.add_argument("--db", default="data/inventory.sqlite", help="Inventario SQLite (default: data/inventory.sqlite)")
+    p_export.add_argument("--csv", default="data/inventory.csv", help="CSV de salida (default: data/inventory.csv)")
+    args = parser.parse_args()
+
+    ROOT = Path(__file__).resolve().parent  # -> src/
+    export_csv(ROOT.parent / args.db, ROOT.parent / args.csv)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+preprocessing.py
+- Carga de imágenes común a la app y a las herramientas batch (cascada, índice de
+  embeddings, scoring distribuido).
+- Decodificación a resolución reducida: en JPEG, Image.draft() pide a libjpeg el escalado
+  DCT (1/2, 1/4, 1/8) más pequeño que sigue siendo >= target_size, así una foto de 12 MP se
+  decodifica directamente a ~1/8 de sus píxeles en vez de entera.
+- Protección frente a "decompression bombs": se comprueba el número de píxeles de la
+  cabecera antes de decodificar (ImageTooLargeError si supera max_pixels).
+- Orientación EXIF y conversión de modos (RGBA, LA, P, CMYK, L...) a RGB en un solo sitio.
+- read_image: la misma decodificación (open_image) dentro de pipelines tf.data
+  (train_effnet.py, cascade_classifier.py), para entrenar con lo mismo que se sirve.
+"""
+from pathlib import Path
+from PIL import Image, ImageOps
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+
+# ---------------- CONFIG ----------------
+TARGET_SIZE = (300, 300)          # entrada de EfficientNetB3
+MAX_PIXELS = 64_000_000           # ~64 MP: por encima se rechaza sin decodificar
+# ----------------------------------------
+
+class ImageTooLargeError(Exception):
+    """La imagen declara más píxeles de los permitidos."""
+
+def open_image(source, target_size=TARGET_SIZE, max_pixels: int = MAX_PIXELS):
+    """
+    Abre source (ruta o fichero) y devuelve una imagen PIL RGB de tamaño target_size,
+    con la orientación EXIF aplicada.
+    """
+    with Image.open(source) as img:
+        w, h = img.size
+        if w * h > max_pixels:
+            raise ImageTooLargeError(f"La imagen tiene {w}x{h} píxeles (máximo {max_pixels})")
+
+        # Escalado DCT de libjpeg (solo JPEG; en otros formatos no hace nada). Se pide el lado
+        # mayor en ambos ejes para que siga siendo >= target_size tras rotar por EXIF.
+        side = max(target_size)
+        img.draft("RGB", (side, side))
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return img.resize(target_size, Image.BILINEAR)
+
+def load_image_array(source, target_size=TARGET_SIZE, max_pixels: int = MAX_PIXELS):
+    """Imagen como array float32 (h, w, 3) en [0, 255]."""
+    return np.asarray(open_image(source, target_size, max_pixels), dtype=np.float32)
+
+def load_batch(paths, target_size=TARGET_SIZE, max_pixels: int = MAX_PIXELS):
+    """
+    Carga varias imágenes como array (N, h, w, 3) float32 en [0, 255].
+    Devuelve también los índices de las rutas que se pudieron leer.
+    """
+    arrays, valid = [], []
+    for i, p in enumerate(paths):
+        try:
+            arrays.append(load_image_array(p, target_size, max_pixels))
+            valid.append(i)
+        except Exception as e:
+            print(f"  ! No se pudo leer {p}: {e}")
+    if not arrays:
+        return np.zeros((0, target_size[1], target_size[0], 3), dtype=np.float32), valid
+    return np.stack(arrays), valid
+
+def _read_for_tf(path, target_size):
+    return np.asarray(open_image(path.decode(), tuple(int(v) for v in target_size)), dtype=np.uint8)
+
+def read_image(path, target_size=TARGET_SIZE):
+    """
+    Versión tf.data (entrenamiento y modelo de criba): tensor de ruta -> imagen uint8
+    (h, w, 3) de tamaño target_size. Pasa por open_image, igual que la app: orientación EXIF,
+    límite de píxeles, formatos que tf.io no decodifica (TIFF, WebP) y mismo redimensionado.
+    Una imagen ilegible o demasiado grande produce un error del dataset (ver ignore_errors).
+    """
+    import tensorflow as tf
+
+    w, h = target_size
+    img = tf.numpy_function(_read_for_tf, [path, tf.constant(target_size)], tf.uint8)
+    img.set_shape([h, w, 3])
+    return img
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Mide la latencia de preprocesado de imágenes.")
+    parser.add_argument("images", nargs="+", help="Imágenes a preprocesar")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por imagen (default: 5)")
+    args = parser.parse_args()
+
+    for p in args.images:
+        time_start = time.perf_counter()
+        for _ in range(args.repeat):
+            load_image_array(Path(p))
+        reduced_ms = 1000 * (time.perf_counter() - time_start) / args.repeat
+
+        time_start = time.perf_counter()
+        for _ in range(args.repeat):
+            with Image.open(p) as img:
+                np.asarray(img.convert("RGB").resize(TARGET_SIZE), dtype=np.float32)
+        full_ms = 1000 * (time.perf_counter() - time_start) / args.repeat
+        print(f"{p}: reducida {reduced_ms:.1f} ms  completa {full_ms:.1f} ms  (x{full_ms / reduced_ms:.1f})")
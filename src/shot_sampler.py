@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+shot_sampler.py
+- Muestreo de frames adaptado a los cambios de plano (shot boundaries) de un vídeo.
+- Una sola pasada de decodificación: cada `stride` frames (analysis_fps por segundo) se
+  reduce el frame a 64x36, se calcula un histograma HSV y se compara con el anterior
+  (distancia de Bhattacharyya). Si la distancia supera cut_threshold empieza un plano nuevo.
+- Bajo un presupuesto de frames se eligen frames representativos por plano:
+    * al menos uno por plano (si hay más planos que presupuesto se quedan los más largos)
+    * el resto se reparte en proporción a la duración de cada plano
+  La memoria está acotada: por plano se guardan entre max(3, budget) y el doble de
+  candidatos equiespaciados, suficientes para cubrir cualquier reparto del presupuesto.
+- Se usa en inferencia (streamlit_app/app.py -> predict_video) y en la extracción del
+  dataset (extract_frames_and_inventory.py --sampling shots).
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+import cv2
+
+ANALYSIS_SIZE = (64, 36)     # tamaño reducido para detectar cortes
+ANALYSIS_FPS = 4.0           # frames analizados por segundo de vídeo
+CUT_THRESHOLD = 0.35         # distancia de Bhattacharyya a partir de la cual hay corte
+MIN_SHOT_SAMPLES = 2         # evita que un destello aislado abra dos planos
+CANDIDATES_PER_SHOT = 3      # mínimo de candidatos por plano (se escala al presupuesto)
+
+def frame_histogram(small_bgr):
+    """Histograma H-S normalizado de un frame BGR reducido."""
+    hsv = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+def spread_positions(m: int, k: int):
+    """k posiciones equiespaciadas y centradas dentro de una lista de longitud m."""
+    k = min(k, m)
+    return ((np.arange(k) + 0.5) * m / k).astype(int).tolist()
+
+class ShotSampler:
+    """
+    Detector de planos incremental. Se alimenta frame a frame con push() y
+    finish() devuelve [(frame_index, payload), ...] ordenados por índice.
+    payload es lo que el llamador quiera conservar (frame ya redimensionado, None...).
+    """
+
+    def __init__(self, budget: int, cut_threshold: float = CUT_THRESHOLD,
+                 min_shot_samples: int = MIN_SHOT_SAMPLES,
+                 candidates_per_shot: int = CANDIDATES_PER_SHOT):
+        self.budget = max(1, int(budget))
+        self.cut_threshold = cut_threshold
+        self.min_shot_samples = min_shot_samples
+        # Un plano puede recibir todo el presupuesto: se guardan al menos `budget` candidatos
+        self.candidates_per_shot = max(1, candidates_per_shot, self.budget)
+        self.shots = []
+        self.current = None
+        self.prev_hist = None
+
+    def push(self, index: int, small_bgr, payload=None):
+        hist = frame_histogram(small_bgr)
+        is_cut = (
+            self.current is None
+            or (self.current["samples"] >= self.min_shot_samples
+                and cv2.compareHist(self.prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.cut_threshold)
+        )
+        if is_cut:
+            self._close_shot()
+            self.current = {"start": index, "end": index, "samples": 0, "step": 1, "candidates": []}
+        self.prev_hist = hist
+
+        shot = self.current
+        # Decimación: se guarda 1 de cada `step` frames; al llenarse se descarta uno de cada dos
+        if shot["samples"] % shot["step"] == 0:
+            shot["candidates"].append((index, payload))
+            if len(shot["candidates"]) >= 2 * self.candidates_per_shot:
+                shot["candidates"] = shot["candidates"][::2]
+                shot["step"] *= 2
+        shot["samples"] += 1
+        shot["end"] = index
+
+    def _close_shot(self):
+        if self.current is None:
+            return
+        self.shots.append(self.current)
+        self.current = None
+        # Nunca se guardan más planos que el presupuesto: se descarta el más corto
+        if len(self.shots) > self.budget:
+            shortest = min(range(len(self.shots)), key=lambda i: self.shots[i]["samples"])
+            del self.shots[shortest]
+
+    def boundaries(self):
+        """Planos conservados como (inicio, fin) en índices de frame."""
+        return [(s["start"], s["end"]) for s in self.shots]
+
+    def finish(self):
+        self._close_shot()
+        if not self.shots:
+            return []
+
+        # 1 frame por plano y el resto en proporción a la duración (mayor resto)
+        lengths = np.array([s["samples"] for s in self.shots], dtype=float)
+        alloc = np.ones(len(self.shots), dtype=int)
+        remaining = self.budget - len(self.shots)
+        if remaining > 0:
+            share = remaining * lengths / lengths.sum()
+            extra = np.floor(share).astype(int)
+            order = np.argsort(-(share - extra))
+            extra[order[:remaining - extra.sum()]] += 1
+            alloc += extra
+
+        # Los planos con menos candidatos que su cupo ceden el sobrante a los más largos
+        capacity = np.array([len(s["candidates"]) for s in self.shots])
+        deficit = int(np.maximum(alloc - capacity, 0).sum())
+        alloc = np.minimum(alloc, capacity)
+        for i in np.argsort(-lengths):
+            if deficit <= 0:
+                break
+            give = min(deficit, capacity[i] - alloc[i])
+            alloc[i] += give
+            deficit -= give
+
+        selected = []
+        for shot, k in zip(self.shots, alloc):
+            cands = shot["candidates"]
+            selected.extend(cands[p] for p in spread_positions(len(cands), k))
+        return sorted(selected, key=lambda item: item[0])
+
+def sample_video(video_path, budget: int, target_size=None, analysis_fps: float = ANALYSIS_FPS,
+                 cut_threshold: float = CUT_THRESHOLD):
+    """
+    Recorre el vídeo una vez y devuelve (fps, [(frame_index, frame), ...]).
+    Si target_size se indica, frame es el RGB redimensionado a target_size; si no, None.
+    Devuelve (fps, []) si el vídeo no se puede abrir.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return 0.0, []
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    if fps <= 0:
+        fps = 25.0
+    stride = max(1, int(round(fps / analysis_fps)))
+
+    sampler = ShotSampler(budget, cut_threshold=cut_threshold)
+    index = 0
+    while True:
+        # grab() avanza sin convertir el frame; solo se recupera 1 de cada `stride`
+        if index % stride:
+            if not cap.grab():
+                break
+            index += 1
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        small = cv2.resize(frame, ANALYSIS_SIZE, interpolation=cv2.INTER_AREA)
+        payload = None
+        if target_size is not None:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            payload = cv2.resize(rgb, target_size, interpolation=cv2.INTER_AREA)
+        sampler.push(index, small, payload)
+        index += 1
+
+    cap.release()
+    return fps, sampler.finish()
+
+def shot_timestamps(video_path: Path, budget: int, analysis_fps: float = ANALYSIS_FPS):
+    """Timestamps (segundos) de los frames representativos por plano."""
+    fps, samples = sample_video(video_path, budget, analysis_fps=analysis_fps)
+    return [round(idx / fps, 3) for idx, _ in samples]
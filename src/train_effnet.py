@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+train_effnet.py
+- Entrenamiento reproducible del clasificador EfficientNetB3 (6 clases) a partir de los
+  splits del inventario (inventory.sqlite / inventory.csv).
+- Pipeline tf.data: decodificación y redimensionado en paralelo (AUTOTUNE), caché opcional
+  en disco (uint8 ya redimensionado), barajado determinista con semilla y prefetch.
+  Los ficheros de caché llevan un hash de (rutas, etiquetas, IMG_SIZE): un inventario
+  regenerado no reutiliza imágenes ni etiquetas antiguas.
+- Dos fases, como en los notebooks:
+    * Fase 1: base congelada, solo se entrena la cabeza (con class_weights balanceados)
+    * Fase 2: fine-tuning de las últimas capas de la base con learning rate bajo
+  Cada fase guarda checkpoints (mejor val_accuracy) y BackupAndRestore permite reanudar un
+  entrenamiento interrumpido con --resume (sin --resume se borran los backups anteriores).
+- El historial se escribe con el mismo formato que notebooks/training_history1/2.json.
+- Ejecutar:
+    python train_effnet.py --csv data/inventory.csv --epochs_phase1 25 --epochs_phase2 40 --cache_dir cache
+"""
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import argparse
+import hashlib
+import shutil
+import json
+import time
+import os
+
+from inventory_store import read_inventory
+from preprocessing import read_image
+
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+
+import tensorflow as tf
+
+# ---------------- CONFIG ----------------
+ROOT = Path(__file__).resolve().parent  # -> src/
+MODELS_DIR = ROOT.parent / "models"
+CLASS_INDICES_PATH = ROOT.parent / "notebooks" / "class_indices.json"
+OUTPUT_MODEL = MODELS_DIR / "final_effnetB3_classifier_6classes.keras"
+
+IMG_SIZE = (300, 300)
+SEED = 42
+BASE_NAME = "efficientnetb3"
+# ----------------------------------------
+
+def load_split(csv_path: Path, split: str, class_indices: dict):
+    """Rutas absolutas y etiquetas de un split (solo frames/imágenes válidos)."""
+    df = read_inventory(csv_path, columns=["category", "relative_path"], valid_only=True, split=split)
+    df = df[df["category"].isin(class_indices)]
+    paths = [str(ROOT.parent / p) for p in df["relative_path"]]
+    labels = [class_indices[c] for c in df["category"]]
+    return paths, labels
+
+def decode_image(path, label):
+    # uint8 ya redimensionado a IMG_SIZE: ocupa 4 veces menos en la caché
+    return read_image(path, IMG_SIZE), label
+
+def make_dataset(paths, labels, batch_size: int, training: bool, cache_file: str = None,
+                 shuffle_buffer: int = 2048, seed: int = SEED):
+    """
+    Sin caché se barajan las rutas (barato) antes de decodificar. Con caché las rutas se
+    barajan una vez con la semilla antes de decodificar y guardar (el inventario va agrupado
+    por categoría) y en cada época se baraja además con un buffer acotado.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if cache_file is None:
+        if training:
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.map(decode_image, num_parallel_calls=tf.data.AUTOTUNE)
+        # Imágenes ilegibles o demasiado grandes se saltan en vez de abortar el fit
+        ds = ds.apply(tf.data.experimental.ignore_errors())
+    else:
+        if training:
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=False)
+        ds = ds.map(decode_image, num_parallel_calls=tf.data.AUTOTUNE)
+        ds = ds.apply(tf.data.experimental.ignore_errors()).cache(cache_file)
+        if training:
+            ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    ds = ds.map(lambda x, y: (tf.cast(x, tf.float32), y), num_parallel_calls=tf.data.AUTOTUNE)
+    ds = ds.batch(batch_size)
+    if training:
+        augment = tf.keras.Sequential([
+            tf.keras.layers.RandomFlip("horizontal", seed=seed),
+            tf.keras.layers.RandomRotation(0.05, seed=seed),
+        ])
+        ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+def cache_key(paths, labels):
+    """Hash corto de (rutas, etiquetas, IMG_SIZE) para nombrar los ficheros de caché."""
+    h = hashlib.sha1(repr(IMG_SIZE).encode())
+    for path, label in zip(paths, labels):
+        h.update(f"{path}\t{label}\n".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+def prepare_cache_dir(cache_dir: Path, resume: bool):
+    """
+    Sin --resume se vacía la caché. Con --resume se conserva, pero se borran los *.lockfile
+    que deja tf.data si la primera época se interrumpió (si no, .cache() falla).
+    """
+    if not resume and cache_dir.exists():
+        print(f"Vaciando caché: {cache_dir}")
+        shutil.rmtree(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for lockfile in cache_dir.glob("*.lockfile"):
+        lockfile.unlink()
+
+def balanced_class_weights(labels, num_classes: int):
+    """n_total / (num_classes * n_clase), como en training_history1.json."""
+    counts = [labels.count(c) for c in range(num_classes)]
+    total = len(labels)
+    return {c: total / (num_classes * n) for c, n in enumerate(counts) if n > 0}
+
+def build_model(num_classes: int):
+    """EfficientNetB3 congelada + cabeza de clasificación (recibe RGB en [0, 255])."""
+    base = tf.keras.applications.EfficientNetB3(include_top=False, weights="imagenet",
+                                                input_shape=(*IMG_SIZE, 3), pooling="avg")
+    base.trainable = False
+    inputs = tf.keras.Input(shape=(*IMG_SIZE, 3))
+    x = base(inputs, training=False)
+    x = tf.keras.layers.Dropout(0.3)(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation="softmax")(x)
+    return tf.keras.Model(inputs, outputs, name="effnetB3_classifier")
+
+def unfreeze_top(model, n_layers: int):
+    """Descongela las últimas n_layers de la base, manteniendo BatchNormalization congeladas."""
+    base = model.get_layer(BASE_NAME)
+    base.trainable = True
+    for layer in base.layers[:-n_layers]:
+        layer.trainable = False
+    for layer in base.layers[-n_layers:]:
+        if isinstance(layer, tf.keras.layers.BatchNormalization):
+            layer.trainable = False
+
+class LearningRateLogger(tf.keras.callbacks.Callback):
+    """Añade learning_rate a los logs de cada época (columna del historial)."""
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None and "learning_rate" not in logs:
+            logs["learning_rate"] = float(tf.keras.backend.get_value(self.model.optimizer.learning_rate))
+
+def phase_callbacks(checkpoint_dir: Path, phase: str):
+    return [
+        tf.keras.callbacks.BackupAndRestore(backup_dir=str(checkpoint_dir / f"backup_{phase}")),
+        tf.keras.callbacks.ModelCheckpoint(str(checkpoint_dir / f"best_{phase}.keras"),
+                                           monitor="val_accuracy", save_best_only=True),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor="val_loss", factor=0.5, patience=3, min_lr=1e-7),
+        LearningRateLogger(),
+    ]
+
+def save_history(path: Path, history: dict, **extra):
+    payload = {"history": {k: [float(v) for v in values] for k, values in history.items()}}
+    payload.update(extra)
+    with open(path, "w") as f:
+        json.dump(payload, f)
+    print(f"Historial guardado en: {path}")
+
+def train(args):
+    tf.keras.utils.set_random_seed(args.seed)
+    if args.intra_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.intra_threads)
+    if args.inter_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(args.inter_threads)
+
+    with open(CLASS_INDICES_PATH, "r") as f:
+        class_indices = json.load(f)
+    num_classes = len(class_indices)
+
+    csv_path = ROOT.parent / args.csv
+    train_paths, train_labels = load_split(csv_path, "train", class_indices)
+    val_paths, val_labels = load_split(csv_path, "val", class_indices)
+    print(f"Train: {len(train_paths)}  Val: {len(val_paths)}")
+
+    cache_train = cache_val = None
+    if args.cache_dir:
+        cache_dir = ROOT.parent / args.cache_dir
+        prepare_cache_dir(cache_dir, args.resume)
+        cache_train = str(cache_dir / f"train_{cache_key(train_paths, train_labels)}")
+        cache_val = str(cache_dir / f"val_{cache_key(val_paths, val_labels)}")
+
+    train_ds = make_dataset(train_paths, train_labels, args.batch_size, True, cache_train, seed=args.seed)
+    val_ds = make_dataset(val_paths, val_labels, args.batch_size, False, cache_val, seed=args.seed)
+
+    checkpoint_dir = ROOT.parent / args.checkpoint_dir
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    history_dir = ROOT.parent / args.history_dir
+    history_dir.mkdir(parents=True, exist_ok=True)
+    phase1_model = checkpoint_dir / "phase1.keras"
+
+    # Sin --resume se empieza de cero: un backup de una ejecución interrumpida anterior
+    # haría que BackupAndRestore continuase desde él sin avisar
+    if not args.resume:
+        for backup in checkpoint_dir.glob("backup_phase*"):
+            print(f"Eliminando backup anterior: {backup}")
+            shutil.rmtree(backup)
+
+    # ---------- Fase 1: cabeza ----------
+    class_weights = balanced_class_weights(train_labels, num_classes)
+    if args.resume and phase1_model.exists():
+        print(f"Reanudando: fase 1 ya completada ({phase1_model})")
+        model = tf.keras.models.load_model(phase1_model)
+    else:
+        model = build_model(num_classes)
+        model.compile(optimizer=tf.keras.optimizers.Adam(args.lr_phase1),
+                      loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+        h1 = model.fit(train_ds, validation_data=val_ds, epochs=args.epochs_phase1,
+                       class_weight=class_weights, callbacks=phase_callbacks(checkpoint_dir, "phase1"))
+        model.save(phase1_model)
+        save_history(history_dir / "training_history1.json", h1.history,
+                     initial_epoch=args.epochs_phase1, class_weights=class_weights)
+
+    # ---------- Fase 2: fine-tuning ----------
+    unfreeze_top(model, args.unfreeze_layers)
+    model.compile(optimizer=tf.keras.optimizers.Adam(args.lr_phase2),
+                  loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+    h2 = model.fit(train_ds, validation_data=val_ds,
+                   initial_epoch=args.epochs_phase1,
+                   epochs=args.epochs_phase1 + args.epochs_phase2,
+                   callbacks=phase_callbacks(checkpoint_dir, "phase2"))
+    save_history(history_dir / "training_history2.json", h2.history)
+
+    output = ROOT.parent / args.output
+    output.parent.mkdir(parents=True, exist_ok=True)
+    model.save(output)
+    print(f"Modelo final guardado en: {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena EfficientNetB3 (2 fases) con tf.data desde el inventario.")
+    parser.add_argument("--csv", default="data/inventory.csv", help="Inventario (default: data/inventory.csv)")
+    parser.add_argument("--batch_size", type=int, default=32, help="Tamaño de batch (default: 32)")
+    parser.add_argument("--epochs_phase1", type=int, default=25, help="Épocas con la base congelada (default: 25)")
+    parser.add_argument("--epochs_phase2", type=int, default=40, help="Épocas de fine-tuning (default: 40)")
+    parser.add_argument("--lr_phase1", type=float, default=1e-3, help="Learning rate fase 1 (default: 1e-3)")
+    parser.add_argument("--lr_phase2", type=float, default=1e-5, help="Learning rate fase 2 (default: 1e-5)")
+    parser.add_argument("--unfreeze_layers", type=int, default=40, help="Capas finales de la base a descongelar (default: 40)")
+    parser.add_argument("--cache_dir", default=None, help="Directorio de caché en disco de las imágenes decodificadas (se vacía salvo con --resume)")
+    parser.add_argument("--checkpoint_dir", default="models/checkpoints", help="Checkpoints (default: models/checkpoints)")
+    parser.add_argument("--history_dir", default="models", help="Dónde escribir training_history1/2.json (default: models)")
+    parser.add_argument("--output", default=str(OUTPUT_MODEL.relative_to(ROOT.parent)), help="Modelo final")
+    parser.add_argument("--resume", action="store_true", help="Reanuda desde los checkpoints y backups existentes (sin él se descartan los backups)")
+    parser.add_argument("--intra_threads", type=int, default=0, help="Hilos intra-op de TensorFlow (0 = automático)")
+    parser.add_argument("--inter_threads", type=int, default=0, help="Hilos inter-op de TensorFlow (0 = automático)")
+    parser.add_argument("--seed", type=int, default=SEED, help="Semilla (default: 42)")
+    args = parser.parse_args()
+
+    time_start = time.perf_counter()
+    train(args)
+    print(f"\n✅ Entrenamiento completado en {(time.perf_counter() - time_start) / 60:.2f} minutos")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+video_ingest.py
+- Ingesta de vídeos subidos sin cargarlos enteros en memoria ni dejar ficheros temporales.
+- El upload (cualquier objeto con read(), p.ej. el UploadedFile de Streamlit) se envía por
+  trozos a ffmpeg por stdin. ffmpeg devuelve por stdout frames BGR ya reducidos a
+  target_size (rawvideo) a analysis_fps, que se pasan al ShotSampler (shot_sampler.py).
+- Presupuestos:
+    * max_bytes    -> tamaño máximo aceptado del upload (VideoBudgetError si se supera)
+    * max_duration -> duración máxima; un vídeo más largo se rechaza (VideoBudgetError)
+                      en vez de truncarse, para no etiquetar contenido que no se ha visto
+    * budget       -> frames devueltos; ShotSampler acota los frames retenidos en memoria
+- Algunos contenedores (mp4 con el átomo 'moov' al final) no se pueden leer desde un pipe.
+  En ese caso el upload se vuelca por trozos a un temporal que se borra siempre al terminar.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+import subprocess
+import threading
+import tempfile
+import cv2
+import os
+
+from shot_sampler import ShotSampler, ANALYSIS_SIZE, ANALYSIS_FPS
+
+# ---------------- CONFIG ----------------
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024   # igual que el límite por defecto de Streamlit
+MAX_DURATION_S = 600.0                 # vídeos de más de 10 minutos se rechazan (usar timeline)
+CHUNK_SIZE = 1024 * 1024               # trozos de 1 MiB hacia ffmpeg
+# ----------------------------------------
+
+class VideoBudgetError(Exception):
+    """El upload supera el presupuesto de tamaño o de duración permitido."""
+
+def _feed(fileobj, stdin, chunk_size: int, max_bytes: int, state: dict):
+    """Copia fileobj -> stdin de ffmpeg por trozos (hilo aparte)."""
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            state["bytes"] += len(chunk)
+            if state["bytes"] > max_bytes:
+                state["over_budget"] = True
+                break
+            stdin.write(chunk)
+    except OSError:
+        # ffmpeg terminó antes (se abortó): no hace falta seguir enviando
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+def _read_exact(stream, n: int):
+    """Lee exactamente n bytes o devuelve None al llegar a EOF."""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = stream.read(n - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+def _decode(source: str, fileobj, budget: int, target_size, analysis_fps: float,
+            max_bytes: int, max_duration: float, chunk_size: int):
+    """
+    Decodifica source ('pipe:0' o una ruta) con ffmpeg y devuelve [(timestamp, frame_rgb), ...].
+    Devuelve None si ffmpeg no produjo ningún frame.
+    """
+    w, h = target_size
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", source,
+        "-vf", f"fps={analysis_fps},scale={w}:{h}",
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "pipe:1",
+    ]
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if fileobj is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    state = {"bytes": 0, "over_budget": False, "over_duration": False}
+    feeder = None
+    if fileobj is not None:
+        feeder = threading.Thread(target=_feed, args=(fileobj, proc.stdin, chunk_size, max_bytes, state),
+                                  daemon=True)
+        feeder.start()
+
+    sampler = ShotSampler(budget)
+    frame_bytes = w * h * 3
+    # Un frame más allá de max_duration basta para saber que el vídeo es demasiado largo
+    max_frames = int(max_duration * analysis_fps)
+    index = 0
+    try:
+        while True:
+            buf = _read_exact(proc.stdout, frame_bytes)
+            if buf is None:
+                break
+            if index > max_frames:
+                state["over_duration"] = True
+                break
+            frame = np.frombuffer(buf, dtype=np.uint8).reshape(h, w, 3)
+            small = cv2.resize(frame, ANALYSIS_SIZE, interpolation=cv2.INTER_AREA)
+            sampler.push(index, small, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            index += 1
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        if feeder is not None:
+            feeder.join()
+
+    if state["over_budget"]:
+        raise VideoBudgetError(f"El vídeo supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB")
+    if state["over_duration"]:
+        raise VideoBudgetError(f"El vídeo supera la duración máxima de {max_duration / 60:g} minutos")
+    if index == 0:
+        return None
+    return [(idx / analysis_fps, frame) for idx, frame in sampler.finish()]
+
+@contextmanager
+def spooled_upload(fileobj, max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = CHUNK_SIZE,
+                   suffix: str = ".mp4"):
+    """
+    Vuelca fileobj por trozos a un fichero temporal y devuelve su ruta.
+    El temporal se elimina siempre al salir del bloque with.
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        written = 0
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise VideoBudgetError(f"El vídeo supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB")
+                f.write(chunk)
+        yield Path(path)
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def stream_video_frames(fileobj, budget: int = 10, target_size=(300, 300),
+                        analysis_fps: float = ANALYSIS_FPS, max_bytes: int = MAX_UPLOAD_BYTES,
+                        max_duration: float = MAX_DURATION_S, chunk_size: int = CHUNK_SIZE):
+    """
+    Devuelve hasta `budget` frames representativos [(timestamp, frame_rgb), ...] de un
+    upload de vídeo, o [] si no se puede decodificar. Lanza VideoBudgetError si el
+    upload supera max_bytes o dura más de max_duration segundos.
+    """
+    size = getattr(fileobj, "size", None)
+    if size is not None and size > max_bytes:
+        raise VideoBudgetError(f"El vídeo supera el tamaño máximo de {max_bytes // (1024 * 1024)} MB")
+
+    seekable = hasattr(fileobj, "seek")
+    if seekable:
+        fileobj.seek(0)
+    samples = _decode("pipe:0", fileobj, budget, target_size, analysis_fps,
+                      max_bytes, max_duration, chunk_size)
+
+    # Contenedores no legibles desde un pipe: temporal por trozos, siempre eliminado
+    if samples is None and seekable:
+        fileobj.seek(0)
+        suffix = Path(getattr(fileobj, "name", "") or "upload.mp4").suffix or ".mp4"
+        with spooled_upload(fileobj, max_bytes, chunk_size, suffix) as path:
+            samples = _decode(str(path), None, budget, target_size, analysis_fps,
+                              max_bytes, max_duration, chunk_size)
+    return samples or []
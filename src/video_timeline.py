@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+video_timeline.py
+- Clasificación por segmentos de tiempo para vídeos largos: en lugar de una etiqueta media
+  para todo el clip devuelve etiqueta y probabilidades por segmento y los rangos marcados.
+- El vídeo se divide en segmentos de segment_len segundos. Los inicios se ajustan al
+  keyframe anterior (ffprobe lee solo los paquetes, sin decodificar), así cada worker hace
+  un seek (-ss antes de -i) que cae en un keyframe y no decodifica frames que descarta.
+- Cada segmento se decodifica en un proceso ffmpeg propio (-threads 1) y se muestrea a
+  `fps` frames por segundo ya redimensionados; los workers corren en paralelo con una
+  ventana acotada de segmentos en vuelo (la memoria no depende de la duración).
+- Los frames de cada segmento se clasifican en batch con predict_fn (B3 o la cascada).
+- Ejecutar:
+    python video_timeline.py --video largo.mp4 --segment 10 --fps 1 --workers 8 --json timeline.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from pathlib import Path
+
+import sys
+sys.dont_write_bytecode = True
+
+import numpy as np
+import subprocess
+import argparse
+import json
+import time
+import os
+
+# ---------------- CONFIG ----------------
+ROOT = Path(__file__).resolve().parent  # -> src/
+MODEL_PATH = ROOT.parent / "models" / "final_effnetB3_classifier_6classes.keras"
+CLASS_INDICES_PATH = ROOT.parent / "notebooks" / "class_indices.json"
+
+SEGMENT_LEN = 10.0        # segundos por segmento
+SAMPLE_FPS = 1.0          # frames analizados por segundo dentro de cada segmento
+TARGET_SIZE = (300, 300)
+SAFE_CLASS = "safe"
+# ----------------------------------------
+
+def probe_duration(video_path: Path):
+    """Duración en segundos (float) usando ffprobe. 0.0 si error."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(video_path)
+    ]
+    try:
+        return float(subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode().strip())
+    except Exception:
+        return 0.0
+
+def keyframe_times(video_path: Path):
+    """Instantes (s) de los keyframes del primer stream de vídeo, leyendo solo paquetes."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        str(video_path)
+    ]
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode()
+    except Exception:
+        return []
+    times = []
+    for line in out.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) >= 2 and "K" in parts[1] and parts[0] not in ("", "N/A"):
+            times.append(float(parts[0]))
+    return sorted(times)
+
+def plan_segments(duration: float, segment_len: float = SEGMENT_LEN, keyframes=None):
+    """
+    [(inicio, fin), ...] cubriendo el vídeo. Con keyframes, cada inicio se mueve al
+    keyframe anterior más cercano (sin retroceder más allá del segmento previo).
+    """
+    starts = list(np.arange(0.0, duration, segment_len))
+    if keyframes:
+        kf = np.asarray(keyframes)
+        aligned = []
+        for i, s in enumerate(starts):
+            k = np.searchsorted(kf, s, side="right") - 1
+            lower = aligned[-1] if aligned else -1.0
+            aligned.append(float(kf[k]) if k >= 0 and kf[k] > lower else float(s))
+        starts = aligned
+    ends = starts[1:] + [duration]
+    return [(float(s), float(e)) for s, e in zip(starts, ends) if e > s]
+
+def decode_segment(video_path: Path, start: float, end: float, fps: float = SAMPLE_FPS,
+                   target_size=TARGET_SIZE):
+    """Frames RGB (n, h, w, 3) uint8 del segmento [start, end) muestreados a fps."""
+    w, h = target_size
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-threads", "1",
+        "-ss", f"{start:.3f}",
+        "-i", str(video_path),
+        "-t", f"{end - start:.3f}",
+        "-vf", f"fps={fps},scale={w}:{h}",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "pipe:1",
+    ]
+    try:
+        raw = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    except subprocess.CalledProcessError:
+        raw = b""
+    n = len(raw) // (w * h * 3)
+    return np.frombuffer(raw[:n * w * h * 3], dtype=np.uint8).reshape(n, h, w, 3)
+
+def merge_flagged(segments):
+    """Une segmentos marcados consecutivos en rangos [{start, end, labels}]."""
+    ranges = []
+    for seg in segments:
+        if not seg["flagged"]:
+            continue
+        if ranges and abs(ranges[-1]["end"] - seg["start"]) < 1e-6:
+            ranges[-1]["end"] = seg["end"]
+            if seg["label"] not in ranges[-1]["labels"]:
+                ranges[-1]["labels"].append(seg["label"])
+        else:
+            ranges.append({"start": seg["start"], "end": seg["end"], "labels": [seg["label"]]})
+    return ranges
+
+def classify_timeline(video_path: Path, predict_fn, inv_class_indices: dict,
+                      segment_len: float = SEGMENT_LEN, fps: float = SAMPLE_FPS,
+                      workers: int = None, target_size=TARGET_SIZE, align_keyframes: bool = True):
+    """
+    predict_fn: batch (N, h, w, 3) float32 en [0, 255] -> probs (N, num_classes).
+    Devuelve {"duration", "segments": [...], "flagged_ranges": [...]}.
+    """
+    duration = probe_duration(video_path)
+    if duration <= 0:
+        return None
+    keyframes = keyframe_times(video_path) if align_keyframes else None
+    segments_plan = plan_segments(duration, segment_len, keyframes)
+
+    workers = workers or os.cpu_count() or 1
+    safe_idx = {v: k for k, v in inv_class_indices.items()}.get(SAFE_CLASS)
+
+    segments = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Ventana de segmentos en vuelo: acota la memoria en vídeos muy largos
+        pending = deque()
+        todo = iter(segments_plan)
+        for start, end in todo:
+            pending.append((start, end, pool.submit(decode_segment, video_path, start, end, fps, target_size)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            start, end, future = pending.popleft()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append((*nxt, pool.submit(decode_segment, video_path, *nxt, fps, target_size)))
+
+            frames = future.result()
+            if len(frames) == 0:
+                continue
+            probs = np.asarray(predict_fn(frames.astype(np.float32)))
+            mean_probs = probs.mean(axis=0)
+            idx = int(np.argmax(mean_probs))
+            segments.append({
+                "start": round(start, 3),
+                "end": round(end, 3),
+                "label": inv_class_indices[idx],
+                "confidence": float(mean_probs[idx]),
+                "probs": {inv_class_indices[i]: float(p) for i, p in enumerate(mean_probs)},
+                "frames": int(len(frames)),
+                "flagged": safe_idx is not None and idx != safe_idx,
+            })
+
+    return {"duration": duration, "segments": segments, "flagged_ranges": merge_flagged(segments)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clasificación por segmentos de vídeos largos.")
+    parser.add_argument("--video", required=True, help="Vídeo a analizar")
+    parser.add_argument("--segment", type=float, default=SEGMENT_LEN, help="Segundos por segmento (default: 10)")
+    parser.add_argument("--fps", type=float, default=SAMPLE_FPS, help="Frames por segundo analizados (default: 1)")
+    parser.add_argument("--workers", type=int, default=None, help="Decodificadores en paralelo (default: núcleos)")
+    parser.add_argument("--batch_size", type=int, default=16, help="Tamaño de batch del modelo (default: 16)")
+    parser.add_argument("--no_keyframe_align", action="store_true", help="No ajustar los segmentos a keyframes")
+    parser.add_argument("--json", default=None, help="Guardar el resultado en este JSON")
+    args = parser.parse_args()
+
+    os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.applications.efficientnet import preprocess_input as eff_preprocess
+
+    model = load_model(MODEL_PATH)
+    with open(CLASS_INDICES_PATH, "r") as f:
+        inv_class_indices = {v: k for k, v in json.load(f).items()}
+
+    time_start = time.perf_counter()
+    result = classify_timeline(
+        Path(args.video),
+        lambda batch: model.predict(eff_preprocess(batch), batch_size=args.batch_size, verbose=0),
+        inv_class_indices, args.segment, args.fps, args.workers,
+        align_keyframes=not args.no_keyframe_align,
+    )
+    elapsed = time.perf_counter() - time_start
+
+    if result is None:
+        print("No se pudo leer el vídeo", args.video)
+        sys.exit(1)
+
+    for seg in result["segments"]:
+        mark = "⚠️" if seg["flagged"] else "  "
+        print(f"{mark} {seg['start']:9.2f}-{seg['end']:9.2f}s  {seg['label']:<10} {seg['confidence']*100:6.2f}%")
+    print(f"\nRangos marcados: {result['flagged_ranges']}")
+    print(f"Vídeo de {result['duration']:.1f} s analizado en {elapsed:.1f} s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Resultado guardado en: {args.json}")
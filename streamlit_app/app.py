@@ -3,14 +3,19 @@ from pathlib import Path
 import numpy as np
 import os
 import json
-from tensorflow.keras.preprocessing import image
 from tensorflow.keras.models import load_model
 from tensorflow.keras.applications.efficientnet import preprocess_input as eff_preprocess
-from PIL import Image
-import tempfile
 import matplotlib.pyplot as plt
 import time
-import cv2
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import cascade_classifier as cascade
+import preprocessing
+import video_ingest
+import embedding_index
+import video_timeline
+import autotune_inference
 
 
 # =====================================================
@@ -65,7 +70,17 @@ div.stButton > button {
 # =====================================================
 ROOT = Path(__file__).resolve().parent  # -> streamlit_app/
 model_path = ROOT.parent / "models" / "final_effnetB3_classifier_6classes.keras"
+
+# Perfil de inferencia de este host (autotune_inference.py): hilos antes de cargar el modelo
+serving_profile = autotune_inference.load_profile("serving") or {}
+autotune_inference.apply_threads(serving_profile)
+serving_batch_size = serving_profile.get("batch_size", autotune_inference.DEFAULT_BATCH_SIZE)
+
 model = load_model(model_path)
+model_predict = autotune_inference.make_predict_fn(
+    model, serving_profile.get("engine", "predict"), serving_batch_size,
+    num_threads=serving_profile.get("intra_threads"),
+)
 
 indices_path = ROOT.parent / "notebooks" / "class_indices.json"
 
@@ -73,61 +88,122 @@ with open(indices_path, "r") as f:
     class_indices = json.load(f)
 inv_class_indices = {v: k for k, v in class_indices.items()}
 
+# Modelo ligero de criba para el modo cascada (opcional)
+screen_model = load_model(cascade.SCREEN_MODEL_PATH) if cascade.SCREEN_MODEL_PATH.exists() else None
+cascade_thresholds = cascade.load_thresholds()
+safe_idx = class_indices[cascade.SAFE_CLASS]
+# Si la calibración no encontró umbrales útiles se escala todo: la cascada solo añadiría coste
+cascade_useful = screen_model is not None and cascade_thresholds.get("escalated_fraction", 0.0) < 1.0
+
+cascade_mode = st.sidebar.checkbox(
+    "Cascade mode (fast pre-screen)",
+    value=cascade_useful,
+    disabled=screen_model is None,
+    help="A small model screens inputs first; only uncertain or possibly unsafe items go to EfficientNetB3."
+         + ("" if cascade_useful or screen_model is None
+            else " Off by default: calibration escalates every item, so it would only add the screening pass."),
+)
+
+timeline_mode = st.sidebar.checkbox(
+    "Timeline mode (long videos)",
+    value=False,
+    help="Classifies the video in time segments decoded in parallel and reports the flagged time ranges.",
+)
+
+# Índice de similitud sobre el inventario (opcional)
+similarity_index = None
+if (embedding_index.INDEX_DIR / "meta.json").exists():
+    similarity_index = embedding_index.EmbeddingIndex()
+    if len(similarity_index) == 0:
+        similarity_index = None
+    elif similarity_index.is_stale():
+        # Inventario regenerado tras construir el índice: los row_id ya no son válidos
+        st.sidebar.warning("Similarity index is out of date with the inventory; rebuild it to enable similar-item search.")
+        similarity_index = None
+    else:
+        embedder = embedding_index.make_embedder(model)
+
+if "cascade_items" not in st.session_state:
+    st.session_state.cascade_items = 0
+    st.session_state.cascade_escalated = 0
+    st.session_state.cascade_counted = set()
+
+# Streamlit re-ejecuta el script en cada interacción: cada upload suma una sola vez
+count_cascade = False
+
+def run_model(batch):
+    """Predice un batch (N, 300, 300, 3) en [0, 255] con B3 o con la cascada"""
+    if cascade_mode and screen_model is not None:
+        preds, escalated = cascade.cascade_predict(batch, model, screen_model, safe_idx,
+                                                   cascade_thresholds, batch_size=serving_batch_size,
+                                                   full_predict=model_predict)
+        if count_cascade:
+            st.session_state.cascade_items += len(escalated)
+            st.session_state.cascade_escalated += int(escalated.sum())
+        return preds
+    return model_predict(eff_preprocess(batch))
+
 # =====================================================
 # FUNCIONES DE PREDICCIÓN
 # =====================================================
-def predict_image(img_path):
-    """Predice una imagen individual"""
-    img = image.load_img(img_path, target_size=(300, 300))
-    img_array = image.img_to_array(img)
+def predict_image(img_array):
+    """Predice una imagen individual ya preprocesada (300, 300, 3)"""
     img_array = np.expand_dims(img_array, axis=0)
-    img_array = eff_preprocess(img_array)
 
-    preds = model.predict(img_array)
+    preds = run_model(img_array)
     idx = np.argmax(preds[0])
     return inv_class_indices[idx], preds[0][idx], preds[0]
 
-# saca una muestra de 10 frames por video
-def predict_video(video_path, num_samples=10, target_size=(300, 300)):
-    """Predice un video seleccionando solo N frames equidistantes."""
-
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return None, None, None
-
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    if total_frames == 0:
-        return None, None, None
-
-    # Elegir 5 frames equidistantes
-    frame_indices = np.linspace(0, total_frames - 1, num_samples, dtype=int)
-
-    frames = []
-
-    for frame_id in frame_indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
-        ret, frame = cap.read()
-        if not ret:
-            continue
-
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame_resized = cv2.resize(frame_rgb, target_size)
-        frame_preprocessed = eff_preprocess(np.expand_dims(frame_resized, axis=0))
-        frames.append(frame_preprocessed)
-
-    cap.release()
+# saca una muestra de hasta 10 frames por video, repartidos entre los planos detectados
+def predict_video(video_file, num_samples=10, target_size=(300, 300)):
+    """
+    Predice un video con frames representativos de cada plano (shot boundaries).
+    El upload se envía por trozos a ffmpeg: no se copia entero en memoria ni en /tmp.
+    """
 
-    if not frames:
+    samples = video_ingest.stream_video_frames(video_file, num_samples, target_size=target_size)
+    if not samples:
         return None, None, None
 
-    frames_array = np.vstack(frames)
-    preds = model.predict(frames_array, batch_size=5, verbose=0)
+    frames_array = np.stack([frame for _, frame in samples]).astype(np.float32)
+    preds = run_model(frames_array)
 
     mean_preds = np.mean(preds, axis=0)
     idx = np.argmax(mean_preds)
 
     return inv_class_indices[idx], mean_preds[idx], preds
 
+def show_timeline(timeline):
+    """Muestra etiquetas por segmento y rangos marcados de un video largo"""
+    segments = timeline["segments"]
+    ranges = timeline["flagged_ranges"]
+
+    if ranges:
+        st.error(f"⚠️ {len(ranges)} flagged time range(s) in {timeline['duration']:.0f}s of video")
+        st.table([
+            {"start": f"{r['start']:.1f}s", "end": f"{r['end']:.1f}s", "labels": ", ".join(r["labels"])}
+            for r in ranges
+        ])
+    else:
+        st.success(f"No flagged segments in {timeline['duration']:.0f}s of video")
+
+    st.subheader("📉 Probability per segment (plot)")
+    fig, ax = plt.subplots(figsize=(10, 4))
+    starts = [seg["start"] for seg in segments]
+    for cls in inv_class_indices.values():
+        ax.step(starts, [seg["probs"][cls] for seg in segments], where="post", label=cls)
+    ax.set_xlabel("time (s)")
+    ax.set_title("Prediction per time segment")
+    ax.legend()
+    st.pyplot(fig)
+
+    st.subheader("Segments:")
+    st.dataframe(
+        [{"start": seg["start"], "end": seg["end"], "label": seg["label"],
+          "confidence": round(seg["confidence"], 4)} for seg in segments],
+        hide_index=True,
+    )
+
 
 # =====================================================
 # INTERFAZ STREAMLIT
@@ -166,38 +242,49 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# Se rellena tras la predicción para que refleje el upload actual
+escalation_metric = st.sidebar.empty()
+
+def show_escalation():
+    """Porcentaje de elementos escalados a B3 en la sesión"""
+    if cascade_mode and st.session_state.cascade_items:
+        escalated_pct = 100 * st.session_state.cascade_escalated / st.session_state.cascade_items
+        escalation_metric.metric("Escalated to EfficientNetB3", f"{escalated_pct:.1f}%",
+                                 help=f"{st.session_state.cascade_escalated} of {st.session_state.cascade_items} items this session")
+
+if cascade_mode and "accuracy_delta" in cascade_thresholds:
+    st.sidebar.caption(
+        f"Calibrated on val: {cascade_thresholds['escalated_fraction']*100:.1f}% escalated, "
+        f"accuracy delta {cascade_thresholds['accuracy_delta']*100:+.2f} pts"
+    )
+
 if uploaded_file:
+    count_cascade = uploaded_file.file_id not in st.session_state.cascade_counted
 
     # ============================
     # IMÁGENES
     # ============================
     if uploaded_file.type.startswith("image"):
-        # Abrir imagen
-        img = Image.open(uploaded_file)
-
-        # Convertir a RGB si tiene canal alfa (RGBA, LA, P)
-        if img.mode in ("RGBA", "LA", "P"):
-            img = img.convert("RGB")
-
         # Mostrar imagen centrada
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            st.image(img, width=350)
-
-        # Obtener la extensión original del archivo
-        suffix = os.path.splitext(uploaded_file.name)[1].lower()
-
-        # Guardar temporal respetando la extensión original
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            temp_path = tmp.name
-            img.save(temp_path)
+            st.image(uploaded_file, width=350)
 
         # Placeholder de estado
         status = st.empty()
         status.info("⏳ Analyzing image...")
 
+        # Decodificar a resolución reducida (EXIF, RGBA/P -> RGB y límite de píxeles en preprocessing)
+        uploaded_file.seek(0)
+        try:
+            img_array = preprocessing.load_image_array(uploaded_file)
+        except Exception as e:
+            status.empty()
+            st.error(f"The image could not be processed: {e}")
+            st.stop()
+
         # Predicción
-        label, conf, preds = predict_image(temp_path)
+        label, conf, preds = predict_image(img_array)
 
         # Limpiar mensaje
         status.empty()
@@ -218,6 +305,15 @@ if uploaded_file:
         prob_df = {inv_class_indices[i]: float(preds[i]) for i in range(len(preds))}
         st.json(prob_df)
 
+        # Elementos del inventario parecidos
+        # (bajo demanda: el embedding es otra pasada completa de EfficientNetB3)
+        if similarity_index is not None and st.button("Find similar training items"):
+            with st.expander("Similar training items", expanded=True):
+                query = embedding_index.embed_batch(embedder, np.expand_dims(img_array, axis=0))[0]
+                results = similarity_index.search(query, k=8)
+                rows = embedding_index.lookup_rows(similarity_index.meta["csv"], results)
+                st.dataframe(rows[["score", "category", "split", "relative_path"]], hide_index=True)
+
 
     # ============================
     # VIDEOS
@@ -225,40 +321,65 @@ if uploaded_file:
     else:
         st.video(uploaded_file)
 
-        # Guardar temporalmente
-        temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-        with open(temp_path.name, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
         status = st.empty()
-        status.info("⏳ Analizing video...")
 
-        label, conf, preds = predict_video(temp_path.name)
+        if timeline_mode:
+            status.info("⏳ Analizing video timeline...")
+            suffix = os.path.splitext(uploaded_file.name)[1].lower() or ".mp4"
+            uploaded_file.seek(0)
+            try:
+                # El análisis por segmentos necesita un fichero con seek: temporal que se borra siempre
+                with video_ingest.spooled_upload(uploaded_file, suffix=suffix) as video_path:
+                    timeline = video_timeline.classify_timeline(video_path, run_model, inv_class_indices)
+            except video_ingest.VideoBudgetError as e:
+                status.empty()
+                st.error(str(e))
+                st.stop()
+
+            status.empty()
+            if timeline is None or not timeline["segments"]:
+                st.error("The video could not be processed.")
+            else:
+                show_timeline(timeline)
 
-        # Simular procesamiento
-        status.empty()
-        if label is None:
-            st.error("The video could not be processed.")
         else:
-            st.markdown(
-                f"""
-                <div class="results-box">
-                    <div class="pred-label">Prediction: <span style="color: #ffffff;">{label.upper()}</span></div>
-                    <div class="pred-confidence">Average confidence: {conf*100:.2f}%</div>
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
-
-            st.subheader("📉 Probability per frame (plot)")
-            fig, ax = plt.subplots(figsize=(10, 4))
-            for i, cls in inv_class_indices.items():
-                ax.plot([p[i] for p in preds], label=cls)
-            ax.set_title("Evolution of frame-by-frame prediction")
-            ax.legend()
-            st.pyplot(fig)
-
-            preds = preds[0]
-            st.subheader("Probabilities by class:")
-            prob_df = {inv_class_indices[i]: float(preds[i]) for i in range(len(preds))}
-            st.json(prob_df)
+            status.info("⏳ Analizing video...")
+
+            try:
+                label, conf, preds = predict_video(uploaded_file)
+            except video_ingest.VideoBudgetError as e:
+                status.empty()
+                st.error(str(e))
+                st.stop()
+
+            # Simular procesamiento
+            status.empty()
+            if label is None:
+                st.error("The video could not be processed.")
+            else:
+                st.markdown(
+                    f"""
+                    <div class="results-box">
+                        <div class="pred-label">Prediction: <span style="color: #ffffff;">{label.upper()}</span></div>
+                        <div class="pred-confidence">Average confidence: {conf*100:.2f}%</div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True,
+                )
+
+                st.subheader("📉 Probability per frame (plot)")
+                fig, ax = plt.subplots(figsize=(10, 4))
+                for i, cls in inv_class_indices.items():
+                    ax.plot([p[i] for p in preds], label=cls)
+                ax.set_title("Evolution of frame-by-frame prediction")
+                ax.legend()
+                st.pyplot(fig)
+
+                preds = preds[0]
+                st.subheader("Probabilities by class:")
+                prob_df = {inv_class_indices[i]: float(preds[i]) for i in range(len(preds))}
+                st.json(prob_df)
+
+if uploaded_file and cascade_mode:
+    st.session_state.cascade_counted.add(uploaded_file.file_id)
+show_escalation()